@@ -0,0 +1,90 @@
+from threading import Lock
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+
+EXPORT_SUFFIXES = ('.xlsx', '.csv', '.parquet')
+
+
+def route_class(path: str):
+    """
+    Класс запроса: 'export' — выгрузки, сводная выгрузка и скачивание готовых файлов /exports,
+    'interactive' — списки, поиск и выборки по id/url магазинов, постановка и статус задач выгрузки,
+    None — служебные пути (/docs, /metrics), которые не ограничиваются.
+    """
+    if path.endswith(EXPORT_SUFFIXES):
+        return 'export'
+    if path.startswith('/exports/') and (path.startswith('/exports/all.') or path.endswith('/download')):
+        return 'export'
+    if '/products/' in path or '/parsing-items/' in path or path.startswith('/exports'):
+        return 'interactive'
+    return None
+
+
+class AdmissionControl:
+    """
+    Middleware допуска запросов: считает выполняемые запросы по классам и сразу отвечает 503
+    с Retry-After, когда их больше лимита, — вместо очереди, в которой клиенты дождутся таймаута.
+    Выгрузки допускаются, только пока интерактивных запросов меньше interactive_busy,
+    поэтому при нагрузке первыми отбрасываются они.
+    """
+    def __init__(self, interactive=64, export=4, interactive_busy=32, retry_interactive=1, retry_export=30):
+        """
+        :param interactive: предел одновременных интерактивных запросов
+        :param export: предел одновременных выгрузок
+        :param interactive_busy: при стольких интерактивных запросах новые выгрузки не принимаются
+        :param retry_interactive: Retry-After для интерактивных запросов, секунды
+        :param retry_export: Retry-After для выгрузок, секунды
+        """
+        self.limits = {'interactive': interactive, 'export': export}
+        self.retry_after = {'interactive': retry_interactive, 'export': retry_export}
+        self.interactive_busy = interactive_busy
+        self.in_flight = {'interactive': 0, 'export': 0}
+        self.admitted = {'interactive': 0, 'export': 0}
+        self.rejected = {'interactive': 0, 'export': 0}
+        self._lock = Lock()
+
+    def admit(self, kind):
+        with self._lock:
+            full = self.in_flight[kind] >= self.limits[kind]
+            if kind == 'export':
+                full = full or self.in_flight['interactive'] >= self.interactive_busy
+            if full:
+                self.rejected[kind] += 1
+                return False
+            self.in_flight[kind] += 1
+            self.admitted[kind] += 1
+            return True
+
+    def release(self, kind):
+        with self._lock:
+            self.in_flight[kind] -= 1
+
+    def metrics(self):
+        return {
+            kind: {
+                'limit': self.limits[kind],
+                'in_flight': self.in_flight[kind],
+                'admitted': self.admitted[kind],
+                'rejected': self.rejected[kind],
+            }
+            for kind in self.limits
+        }
+
+    async def __call__(self, request: Request, call_next):
+        kind = route_class(request.url.path)
+        if kind is None:
+            return await call_next(request)
+        if not self.admit(kind):
+            return JSONResponse(
+                status_code=503,
+                content={'detail': 'Server is busy, retry later'},
+                headers={'Retry-After': str(self.retry_after[kind])},
+            )
+        try:
+            return await call_next(request)
+        finally:
+            self.release(kind)
+
+
+admission = AdmissionControl()
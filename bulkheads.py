@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+
+class Bulkhead:
+    """
+    Отдельный ограниченный пул потоков для работы с базой одного магазина (или выгрузок).
+    Декорирует sync-обработчик: эндпоинт становится async и ждёт выполнения в своём пуле,
+    поэтому тяжёлые запросы одного магазина не занимают общий threadpool Starlette.
+    """
+    def __init__(self, name, workers=4):
+        self.name = name
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix=f'bulkhead-{name}')
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = Lock()
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        async def handler(*args, **kwargs):
+            with self._lock:
+                self.queued += 1
+            queued_at = time.monotonic()
+
+            def task():
+                wait = time.monotonic() - queued_at
+                with self._lock:
+                    self.queued -= 1
+                    self.active += 1
+                    self.wait_total += wait
+                    self.wait_max = max(self.wait_max, wait)
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    with self._lock:
+                        self.failed += 1
+                    raise
+                finally:
+                    with self._lock:
+                        self.active -= 1
+                        self.completed += 1
+
+            return await asyncio.get_running_loop().run_in_executor(self.executor, task)
+        return handler
+
+    def metrics(self):
+        started = self.completed + self.active
+        return {
+            'workers': self.workers,
+            'active': self.active,
+            'queued': self.queued,
+            'saturation': round(self.active / self.workers, 2),
+            'completed': self.completed,
+            'failed': self.failed,
+            'wait_avg_ms': round(self.wait_total / started * 1000, 1) if started else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 1),
+        }
+
+
+def inline(func):
+    """
+    Лёгкая sync-зависимость (разбор параметров запроса, без ввода-вывода) как async:
+    FastAPI выполняет её в цикле событий, а не в общем threadpool Starlette.
+    """
+    async def dependency(*args, **kwargs):
+        return func(*args, **kwargs)
+    dependency.__signature__ = inspect.signature(func)
+    dependency.__name__ = func.__name__
+    dependency.__doc__ = func.__doc__
+    return dependency
+
+
+bulkheads = {}
+
+
+def bulkhead(name, workers=4):
+    """
+    Пул магазина по имени; повторный вызов возвращает уже созданный.
+    """
+    if name not in bulkheads:
+        bulkheads[name] = Bulkhead(name, workers)
+    return bulkheads[name]
+
+
+# выгрузки xlsx всех магазинов — в отдельном небольшом пуле, чтобы не мешать чтению
+exports = bulkhead('exports', workers=2)
@@ -0,0 +1,195 @@
+import asyncio
+import hashlib
+import json
+from email.utils import formatdate
+from threading import Lock
+from anyio import to_thread
+from fastapi import Depends, HTTPException, Request, Response
+from shared import shared_cache
+from compress import negotiate, compressible, compress
+from packing import accepts_msgpack
+
+
+STORED_HEADERS = ('content-type', 'content-disposition', 'x-total-count')
+
+
+class CacheHit(Exception):
+    def __init__(self, entry):
+        self.entry = entry
+
+
+class Flight:
+    """
+    Ответ, который сейчас собирает один запрос; остальные такие же запросы ждут его.
+    Ожидание асинхронное: ждущие запросы не занимают потоки общего пула Starlette.
+    """
+    def __init__(self):
+        self.event = asyncio.Event()
+        self.entry = None
+
+    def land(self, entry):
+        self.entry = entry
+        self.event.set()
+
+
+class ResponseCache:
+    """
+    Кеш ответов эндпоинтов товаров в общем для воркеров SharedCache.
+    Ключ — (путь, нормализованные параметры, краул, JSON или MessagePack): путь содержит префикс магазина,
+    а новый краул даёт новый ключ; записи помечены краулом и сбрасываются вместе с ним.
+    Одинаковые запросы, пришедшие во время сборки ответа, ждут его, а не собирают заново.
+    Совмещение — в пределах воркера: воркеры serve.py, пока ответа нет в общем кеше, собирают его каждый сам.
+    Сжатые варианты (gzip, zstd) хранятся рядом с оригиналом и сжимаются один раз на краул.
+    """
+    def __init__(self, store=shared_cache, max_entry=4 * 1024 * 1024, flight_timeout=300):
+        self.store = store
+        self.max_entry = max_entry
+        self.flight_timeout = flight_timeout
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.coalesced = 0
+        self.compressed = 0
+        self._flights = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        value = self.store.get(f'response:{key}')
+        if value is None:
+            return None
+        headers, body = value.split(b'\n', 1)
+        return {'body': body, 'headers': json.loads(headers)}
+
+    def put(self, key, entry, crawl=None):
+        body = entry['body']
+        if len(body) > self.max_entry:
+            return
+        self.store.set(f'response:{key}', json.dumps(entry['headers']).encode() + b'\n' + body, crawl=crawl)
+
+    def variant(self, key, entry, encoding, crawl=None):
+        """
+        Сжатый вариант ответа: при первом запросе с этой кодировкой сжимается и сохраняется
+        рядом с оригиналом, дальше отдаётся готовым. Несжимаемые и мелкие ответы — как есть.
+        """
+        if encoding is None or not compressible(entry['headers'].get('content-type'), len(entry['body'])):
+            return entry
+        compressed = self.get(f'{key}:{encoding}')
+        if compressed is None:
+            self.compressed += 1
+            compressed = {'body': compress(entry['body'], encoding), 'headers': {**entry['headers'], 'Content-Encoding': encoding}}
+            self.put(f'{key}:{encoding}', compressed, crawl)
+        return compressed
+
+    def respond(self, key, entry, encoding, validators, crawl=None):
+        entry = self.variant(key, entry, encoding, crawl)
+        return {'body': entry['body'], 'headers': {**entry['headers'], **validators}}
+
+    def take_off(self, key):
+        """
+        Регистрирует сборку ответа по ключу. Возвращает (flight, True) для первого запроса
+        и (flight, False) для тех, кто должен дождаться его результата.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self._flights[key] = Flight()
+            return flight, True
+
+    def land(self, key, flight, entry):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        flight.land(entry)
+
+    def metrics(self):
+        return {
+            **self.store.stats(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'not_modified': self.not_modified,
+            'coalesced': self.coalesced,
+            'compressed': self.compressed,
+            'in_flight': len(self._flights),
+        }
+
+    def dependency(self, catalog, resolve=None):
+        """
+        Зависимость для роутера магазина: отвечает 304 по If-None-Match и отдаёт сохранённый ответ,
+        не выполняя эндпоинт. Промахи сохраняет middleware cache_responses.
+
+        :param catalog: каталог краулов магазина (CrawlCatalog)
+        :param resolve: зависимость краула, которой пользуются эндпоинты роутера, если это не сам catalog
+        """
+        async def cached(request: Request, crawl=Depends(resolve or catalog)):
+            if crawl is None:
+                return
+            # нормализованный набор параметров: порядок, повторы и пустые значения на ответ не влияют
+            params = sorted({(k, v) for k, v in request.query_params.multi_items() if k != 'crawl' and v != ''})
+            packed = accepts_msgpack(request)
+            key = hashlib.blake2b(repr((request.url.path, params, str(crawl.crawlid), packed)).encode(), digest_size=16).hexdigest()
+            encoding = negotiate(request.headers.get('accept-encoding'))
+            validators = {
+                'ETag': f'"{crawl.crawlid}-{key}-{encoding}"' if encoding else f'"{crawl.crawlid}-{key}"',
+                'Last-Modified': formatdate(crawl.created_at.timestamp(), usegmt=True),
+                'Cache-Control': 'private, no-cache',
+                'Vary': 'Accept, Accept-Encoding',
+            }
+            if validators['ETag'] in request.headers.get('if-none-match', ''):
+                self.not_modified += 1
+                raise HTTPException(status_code=304, headers=validators)
+            entry = await to_thread.run_sync(self.get, key)
+            if entry is not None:
+                self.hits += 1
+                raise CacheHit(await to_thread.run_sync(self.respond, key, entry, encoding, validators, catalog.tag(crawl)))
+            flight, leader = self.take_off(key)
+            if not leader:
+                self.coalesced += 1
+            while not leader:
+                try:
+                    await asyncio.wait_for(flight.event.wait(), self.flight_timeout)
+                except asyncio.TimeoutError:
+                    # первый запрос завис — собираем ответ сами, не становясь в очередь за ним
+                    flight = None
+                    break
+                if flight.entry is not None:
+                    raise CacheHit(await to_thread.run_sync(self.respond, key, flight.entry, encoding, validators, catalog.tag(crawl)))
+                # первый запрос завершился ошибкой — ответ собирает один из ждущих, остальные ждут уже его
+                flight, leader = self.take_off(key)
+            self.misses += 1
+            request.state.cache_pending = (key, validators, flight, catalog.tag(crawl), encoding)
+        return cached
+
+
+response_cache = ResponseCache()
+
+
+async def cache_hit(request: Request, exc: CacheHit):
+    entry = exc.entry
+    return Response(content=entry['body'], headers=entry['headers'])
+
+
+async def cache_responses(request: Request, call_next):
+    entry = None
+    try:
+        response = await call_next(request)
+        pending = getattr(request.state, 'cache_pending', None)
+        if pending is None or response.status_code != 200:
+            return response
+        key, validators, _, crawl, encoding = pending
+        body = b''.join([chunk async for chunk in response.body_iterator])
+        headers = {k: v for k, v in response.headers.items() if k in STORED_HEADERS}
+        entry = {'body': body, 'headers': headers}
+
+        def store():
+            response_cache.put(key, entry, crawl)
+            return response_cache.respond(key, entry, encoding, validators, crawl)
+
+        # запись в SQLite может ждать блокировку, а сжатие варианта занимает CPU —
+        # не на цикле событий, чтобы не стояли остальные магазины
+        sent = await to_thread.run_sync(store)
+        return Response(content=sent['body'], status_code=response.status_code, headers=sent['headers'])
+    finally:
+        pending = getattr(request.state, 'cache_pending', None)
+        if pending is not None and pending[2] is not None:
+            response_cache.land(pending[0], pending[2], entry)
@@ -0,0 +1,312 @@
+import fcntl
+import glob
+import json
+import logging
+import mmap
+import os
+import re
+import time
+from datetime import datetime
+from threading import Lock, Thread
+import numpy as np
+from fastapi import Response
+from packing import MsgpackResponse
+from peewee import BooleanField
+from filters import NUMERIC_FIELDS
+from stats import find_field, to_float, PRICE_FIELDS, BRAND_FIELDS, STOCK_FIELDS, NO_STOCK
+
+
+MAGIC = b'PCATv1\0\0'
+ALIGN = 16
+# повтор записи снимка, секунды: пока его пишет другой процесс и после ошибки
+RETRY_BUSY = 5
+RETRY_FAILED = 60
+
+
+def stock_value(field, value):
+    """
+    То же, что filters.stock_condition, для одного значения.
+    """
+    if value is None:
+        return False
+    if isinstance(field, BooleanField):
+        return bool(value)
+    if isinstance(field, NUMERIC_FIELDS):
+        return value > 0
+    return str(value).strip().lower() not in NO_STOCK
+
+
+def strings(values):
+    """
+    Строки одним блоком и таблица смещений: i-я строка — blob[offsets[i]:offsets[i + 1]].
+    """
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum([len(v) for v in values], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(values), dtype=np.uint8)
+
+
+def write_snapshot(path, crawl, model, schema, key='productId'):
+    """
+    Записывает краул в файл снимка: заголовок JSON и выровненные массивы колонок.
+    Файл пишется во временный и атомарно переименовывается.
+
+    :param path: файл снимка
+    :param crawl: законченный краул
+    :param model: модель товара парсера
+    :param schema: схема ответа, которой сериализуются товары
+    :param key: поле id товара для by_ids
+    """
+    price = find_field([model], PRICE_FIELDS)
+    brand = find_field([model], BRAND_FIELDS)
+    stock = find_field([model], STOCK_FIELDS)
+    name = find_field([model], ('name',))
+
+    rows = list(
+        model
+        .select()
+        .where(model.crawlid == crawl.crawlid)
+        .order_by(model._meta.primary_key)
+        .dicts()
+    )
+    size = len(rows)
+    columns = {}
+    header = {'crawlid': str(crawl.crawlid), 'created_at': crawl.created_at.isoformat(), 'size': size, 'brands': []}
+
+    columns['json_offsets'], columns['json'] = strings(
+        [schema.model_validate(row).model_dump_json(by_alias=True).encode() for row in rows])
+
+    ids = [str(row[key]).encode() for row in rows]
+    id_rows = np.array(sorted(range(size), key=ids.__getitem__), dtype=np.int32)
+    columns['id_rows'] = id_rows
+    columns['id_offsets'], columns['ids'] = strings([ids[i] for i in id_rows])
+
+    if price is not None:
+        prices = np.fromiter((to_float(row[price.name]) for row in rows), dtype=np.float64, count=size)
+        columns['price'] = prices
+        # NULL в SQLite идёт первым при ASC и последним при DESC;
+        # строки лежат в порядке первичного ключа, и номер строки — последний ключ, как в ProductFilter.apply
+        keys = np.nan_to_num(prices, nan=-np.inf)
+        columns['order:price'] = np.lexsort((np.arange(size), keys)).astype(np.int32)
+        columns['order:-price'] = np.lexsort((np.arange(size), -keys)).astype(np.int32)
+    if brand is not None:
+        values = [row[brand.name] for row in rows]
+        codes = {value: code for code, value in enumerate(dict.fromkeys(v for v in values if v is not None))}
+        header['brands'] = list(codes)
+        columns['brand'] = np.fromiter((codes.get(v, -1) for v in values), dtype=np.int32, count=size)
+    if stock is not None:
+        columns['stock'] = np.fromiter((stock_value(stock, row[stock.name]) for row in rows), dtype=bool, count=size)
+    if name is not None:
+        names = [row[name.name] for row in rows]
+        columns['order:name'] = np.array(
+            sorted(range(size), key=lambda i: (names[i] is not None, names[i] or '', i)), dtype=np.int32)
+
+    offset = 0
+    header['columns'] = {}
+    for column, array in columns.items():
+        header['columns'][column] = [array.dtype.str, offset, len(array)]
+        offset += -(-array.nbytes // ALIGN) * ALIGN
+    meta = json.dumps(header).encode()
+
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + len(meta).to_bytes(8, 'little') + meta)
+        f.write(b'\0' * (-f.tell() % ALIGN))
+        for array in columns.values():
+            f.write(array.tobytes())
+            f.write(b'\0' * (-f.tell() % ALIGN))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class ColumnarSnapshot:
+    """
+    Снимок краула, отображённый в память (mmap): колонки читаются прямо со страниц файла,
+    которые ОС держит одни на все воркеры. Строки идут в порядке первичного ключа,
+    как в /products/ без сортировки.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'Not a catalog snapshot: {path}')
+        length = int.from_bytes(self._mm[8:16], 'little')
+        header = json.loads(self._mm[16:16 + length])
+        start = -(-(16 + length) // ALIGN) * ALIGN
+
+        self.path = path
+        self.crawlid = header['crawlid']
+        self.created_at = datetime.fromisoformat(header['created_at'])
+        self.size = header['size']
+        self.brands = {value: code for code, value in enumerate(header['brands'])}
+        self.columns = {
+            column: np.frombuffer(self._mm, dtype=np.dtype(dtype), count=count, offset=start + offset)
+            for column, (dtype, offset, count) in header['columns'].items()
+        }
+        self.price = self.columns.get('price')
+        self.brand = self.columns.get('brand')
+        self.stock = self.columns.get('stock')
+        self.json_offsets = self.columns['json_offsets']
+        self.json_start = start + header['columns']['json'][1]
+        self.id_rows = self.columns['id_rows']
+        self.id_offsets = self.columns['id_offsets']
+        self.ids_start = start + header['columns']['ids'][1]
+
+    def page(self, filters, offset: int, limit: int):
+        """
+        Номера строк страницы /products/ с фильтрами и сортировкой, как в ProductFilter.apply.
+        """
+        mask = np.ones(self.size, dtype=bool)
+        if self.price is not None:
+            if filters.price_min is not None:
+                mask &= self.price >= filters.price_min
+            if filters.price_max is not None:
+                mask &= self.price <= filters.price_max
+        if self.brand is not None and filters.brand:
+            mask &= self.brand == self.brands.get(filters.brand, -2)
+        if self.stock is not None and filters.in_stock is not None:
+            mask &= self.stock == filters.in_stock
+
+        order = self.columns.get(f'order:{filters.sort}')
+        if order is None:
+            rows = np.flatnonzero(mask)
+        else:
+            rows = order[mask[order]]
+        return rows[max(offset, 0):max(offset, 0) + max(limit, 0)]
+
+    def product_id(self, k):
+        return self._mm[self.ids_start + self.id_offsets[k]:self.ids_start + self.id_offsets[k + 1]]
+
+    def by_ids(self, product_ids):
+        """
+        Номера строк товаров по id: двоичный поиск по отсортированному индексу id.
+        """
+        rows = set()
+        for product_id in product_ids:
+            target = product_id.encode()
+            lo, hi = 0, self.size
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self.product_id(mid) < target:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            while lo < self.size and self.product_id(lo) == target:
+                rows.add(int(self.id_rows[lo]))
+                lo += 1
+        return sorted(rows)
+
+    def response(self, rows, headers=None, packed=False):
+        start, offsets, mm = self.json_start, self.json_offsets, self._mm
+        content = b'[' + b','.join(mm[start + offsets[i]:start + offsets[i + 1]] for i in rows) + b']'
+        if packed:
+            # в снимке строки уже сериализованы схемой — для MessagePack достаточно разобрать JSON
+            return MsgpackResponse(json.loads(content), headers=headers)
+        return Response(content=content, media_type='application/json', headers=headers)
+
+
+def modified(path):
+    # файл может удалить prune другого процесса
+    try:
+        return os.path.getmtime(path)
+    except FileNotFoundError:
+        return 0
+
+
+class ColumnarStore:
+    """
+    Снимки краулов магазина в каталоге directory, по файлу на краул.
+    Файл нового краула пишет один процесс (под flock), остальные воркеры его открывают.
+    Пока файла нет, запросы читают из SQLite; запросы, начатые на прежнем снимке, дочитывают его.
+    """
+    def __init__(self, model, schema, key='productId', directory='catalog', keep=2, current=None):
+        """
+        :param model: модель товара парсера
+        :param schema: схема ответа, которой сериализуются товары
+        :param key: поле id товара для by_ids
+        :param directory: каталог файлов снимков
+        :param keep: сколько последних файлов магазина хранить
+        :param current: последний законченный краул (например, CrawlCatalog.current) — его файл не удаляется
+        """
+        self.model = model
+        self.schema = schema
+        self.key = key
+        self.directory = directory
+        self.keep = keep
+        self.current = current
+        self.name = os.path.splitext(os.path.basename(model._meta.database.database))[0]
+        self.snapshot = None
+        self._building = None
+        self._retry = 0
+        self._lock = Lock()
+
+    def path(self, crawl):
+        crawlid = re.sub(r'[^\w.-]', '_', str(crawl.crawlid))
+        return os.path.join(self.directory, f'{self.name}-{crawlid}.bin')
+
+    def get(self, crawl):
+        """
+        Снимок этого краула или None. Для краула новее текущего снимка открывает его файл,
+        а если файла ещё нет — запускает его запись в фоне, но не чаще, чем позволяет _retry.
+        """
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.crawlid == str(crawl.crawlid):
+            return snapshot
+        if snapshot is not None and crawl.created_at <= snapshot.created_at:
+            return None
+        path = self.path(crawl)
+        if os.path.exists(path):
+            try:
+                with self._lock:
+                    if self.snapshot is snapshot:
+                        self.snapshot = ColumnarSnapshot(path)
+            except OSError:
+                # файл успел удалить prune другого процесса — читаем из SQLite
+                return None
+            return self.get(crawl)
+        with self._lock:
+            if self._building is None and self._retry <= time.monotonic():
+                self._building = crawl.crawlid
+                Thread(target=self.build, args=(crawl,), daemon=True).start()
+        return None
+
+    def build(self, crawl):
+        path = self.path(crawl)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(path + '.lock', 'w') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # файл пишет другой процесс — не запускаем поток на каждый запрос, пока он не закончит
+                    self._retry = time.monotonic() + RETRY_BUSY
+                    return
+                if not os.path.exists(path):
+                    write_snapshot(path, crawl, self.model, self.schema, self.key)
+                    self.prune(crawl)
+        except Exception:
+            self._retry = time.monotonic() + RETRY_FAILED
+            logging.exception('Catalog snapshot %s failed', path)
+        finally:
+            with self._lock:
+                self._building = None
+
+    def prune(self, crawl):
+        """
+        Удаляет файлы магазина сверх keep последних. Файлы только что собранного
+        и последнего законченного краула не удаляются, даже если они старше.
+        """
+        protected = {self.path(crawl)}
+        current = self.current() if self.current is not None else None
+        if current is not None:
+            protected.add(self.path(current))
+        files = sorted(glob.glob(os.path.join(self.directory, f'{self.name}-*.bin')), key=modified, reverse=True)
+        for path in files[self.keep:]:
+            if path in protected:
+                continue
+            # открытые отображения остаются рабочими и после удаления файла
+            for stale in (path, path + '.lock'):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,129 @@
+import gzip
+import os
+import shutil
+import struct
+import zlib
+from typing import Optional
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# уже сжатые форматы (xlsx — zip, parquet) повторно не сжимаются
+COMPRESSIBLE = ('application/json', 'application/x-ndjson', 'application/msgpack', 'text/')
+MIN_SIZE = 1024
+EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz'}
+# deflate без заголовка gzip и последнего блока — такие куски склеиваются в один член gzip
+GZIP_PART = '.gzpart'
+GZIP_HEADER = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+
+def encodings():
+    """
+    Доступные кодировки в порядке предпочтения сервера: zstd — если установлен zstandard.
+    """
+    return ('zstd', 'gzip') if zstandard is not None else ('gzip',)
+
+
+def negotiate(accept_encoding) -> Optional[str]:
+    """
+    Кодировка ответа по Accept-Encoding: лучшая по q из доступных, при равных q — по порядку encodings().
+    None — отдавать без сжатия.
+    """
+    weights = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    available = encodings()
+    if '*' in weights:
+        weights = {name: weights.get(name, weights['*']) for name in available}
+    best = max(available, key=lambda name: weights.get(name, 0), default=None)
+    return best if weights.get(best, 0) > 0 else None
+
+
+def compressible(content_type, size) -> bool:
+    return size >= MIN_SIZE and (content_type or '').startswith(COMPRESSIBLE)
+
+
+def compress(body: bytes, encoding) -> bytes:
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(body)
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def variant(path, encoding, joinable=False) -> str:
+    if joinable and encoding == 'gzip':
+        return path + GZIP_PART
+    return path + EXTENSIONS[encoding]
+
+
+def precompress(source, path, joinable=False):
+    """
+    Пишет рядом с будущим файлом path его сжатые варианты path.gz и path.zst.
+    Варианты ставятся на место до самого файла: когда path появился, они уже есть.
+
+    :param source: готовый несжатый файл
+    :param path: путь, под которым файл будет отдаваться
+    :param joinable: варианты для склейки нескольких файлов в один ответ (см. join): вместо path.gz — path.gzpart
+    """
+    for encoding in encodings():
+        tmp = variant(source, encoding, joinable)
+        with open(source, 'rb') as src, open(tmp, 'wb') as dst:
+            if encoding == 'zstd':
+                zstandard.ZstdCompressor(level=10).copy_stream(src, dst)
+            elif joinable:
+                packer = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+                for chunk in iter(lambda: src.read(1024 * 1024), b''):
+                    dst.write(packer.compress(chunk))
+                dst.write(packer.flush(zlib.Z_SYNC_FLUSH))
+            else:
+                with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=9, mtime=0) as packed:
+                    shutil.copyfileobj(src, packed, 1024 * 1024)
+        os.replace(tmp, variant(path, encoding, joinable))
+
+
+def join(head: bytes, paths, encoding, chunk_size=1024 * 1024):
+    """
+    Сжатый поток из head и файлов paths, собранный из готовых вариантов precompress(..., joinable=True).
+    zstd — последовательность кадров; gzip — один член: куски deflate склеиваются,
+    а CRC32 в конце считается по несжатым файлам — это много дешевле, чем сжимать заново.
+    """
+    def read(path):
+        with open(path, 'rb') as file:
+            yield from iter(lambda: file.read(chunk_size), b'')
+
+    if encoding == 'zstd':
+        yield compress(head, encoding)
+        for path in paths:
+            yield from read(variant(path, encoding, True))
+        return
+    packer = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    yield GZIP_HEADER + packer.compress(head) + packer.flush(zlib.Z_SYNC_FLUSH)
+    crc, size = zlib.crc32(head), len(head)
+    for path in paths:
+        for chunk in read(path):
+            crc, size = zlib.crc32(chunk, crc), size + len(chunk)
+        yield from read(variant(path, encoding, True))
+    # пустой последний блок deflate и хвост gzip: CRC32 и длина по модулю 2^32
+    yield zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS).flush() + struct.pack('<II', crc, size & 0xffffffff)
+
+
+def remove(path):
+    """
+    Удаляет файл и его сжатые варианты.
+    """
+    for name in [path, path + GZIP_PART] + [variant(path, encoding) for encoding in EXTENSIONS]:
+        try:
+            os.remove(name)
+        except FileNotFoundError:
+            pass
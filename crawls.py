@@ -0,0 +1,109 @@
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException, Query, Request
+from filters import create_index
+from shared import shared_cache
+
+
+LOCAL_TTL = 5
+
+
+class CrawlCatalog:
+    """
+    Каталог краулов магазина по индексу (finished, created_at).
+    Используется как зависимость: без crawl= отдаёт последний законченный краул,
+    с crawl=<id|timestamp> — указанный законченный краул или последний законченный на этот момент;
+    незаконченные краулы не отдаются: их частичные данные попали бы в кеши и сводки.
+    Найденный краул уходит в заголовке X-Crawl-Id: передавая его в crawl= на следующих
+    страницах, клиент читает один и тот же снимок, даже если за это время закончился новый краул.
+    """
+    def __init__(self, model, settle: Optional[timedelta] = None, ttl: float = 30):
+        """
+        :param model: модель Crawl парсера
+        :param settle: для парсеров без флага finished краул считается законченным спустя это время
+        :param ttl: сколько секунд держать в общем кеше указатель на последний законченный краул
+        """
+        self.model = model
+        self.name = f'{model._meta.database.database}:{model._meta.table_name}'
+        self.settle = settle
+        self.ttl = ttl
+        self._current = (0, None)
+        if settle is None:
+            create_index(model, [model.finished, model.created_at])
+        else:
+            create_index(model, [model.created_at])
+        create_index(model, [model.crawlid])
+
+    def finished(self):
+        if self.settle is None:
+            return self.model.finished == True
+        return self.model.created_at <= datetime.now() - self.settle
+
+    def latest(self, at: Optional[datetime] = None):
+        query = self.model.select().where(self.finished())
+        if at is not None:
+            query = query.where(self.model.created_at <= at)
+        return query.order_by(self.model.created_at.desc()).first()
+
+    def get(self, ref: str):
+        try:
+            crawl = self.model.get_or_none((self.model.crawlid == ref) & self.finished())
+        except (TypeError, ValueError):
+            crawl = None
+        if crawl is None:
+            try:
+                crawl = self.latest(at=datetime.fromisoformat(ref))
+            except ValueError:
+                pass
+        if crawl is None:
+            raise HTTPException(status_code=404, detail=f"Crawl not found: {ref}")
+        return crawl
+
+    def refresh(self):
+        pass
+
+    def tag(self, crawl):
+        """
+        Метка краула в общем кеше: id краулов разных магазинов могут совпадать.
+        """
+        return f'{self.name}:{crawl.crawlid}'
+
+    def current(self):
+        """
+        Последний законченный краул. Указатель на него живёт ttl секунд в общем кеше воркеров
+        и LOCAL_TTL секунд в памяти процесса: краулы идут часами,
+        а условные запросы не должны каждый раз ходить в базу парсера.
+        """
+        expires, crawl = self._current
+        if expires < time.monotonic():
+            crawl = self.shared()
+            self._current = (time.monotonic() + min(self.ttl, LOCAL_TTL), crawl)
+        return crawl
+
+    def shared(self):
+        key = f'crawl:{self.name}'
+        crawlid = shared_cache.get_json(key)
+        if crawlid is not None:
+            crawl = self.model.get_or_none(self.model.crawlid == crawlid)
+            if crawl is not None:
+                return crawl
+        self.refresh()
+        crawl = self.latest()
+        if crawl is not None:
+            shared_cache.set_json(key, crawl.crawlid, ttl=self.ttl)
+        return crawl
+
+    def __call__(self, request: Request, crawl: Optional[str] = Query(None, description="ID краула или дата ISO 8601")):
+        found = self.get(crawl) if crawl else self.current()
+        if found is not None:
+            request.state.crawlid = found.crawlid
+        return found
+
+
+async def crawl_headers(request: Request, call_next):
+    response = await call_next(request)
+    crawlid = getattr(request.state, 'crawlid', None)
+    if crawlid is not None:
+        response.headers['X-Crawl-Id'] = str(crawlid)
+    return response
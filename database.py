@@ -1,5 +1,10 @@
+from datetime import datetime
+from hashlib import blake2b
 from secrets import token_urlsafe
-from peewee import SqliteDatabase, Model, CharField
+from uuid import uuid4
+from peewee import OperationalError, SqliteDatabase, Model, CharField, IntegerField, FloatField, TextField, DateTimeField
+from playhouse.migrate import SqliteMigrator, migrate
+from shared import shared_cache
 
 
 db = SqliteDatabase('data.db', pragmas={'journal_mode': 'wal'}, check_same_thread=False)
@@ -13,6 +18,84 @@ class BaseModel(Model):
 class User(BaseModel):
     name = CharField(unique=True)
     token = CharField(default=token_urlsafe)
+    rate_limit = IntegerField(null=True)
+    expensive_rate_limit = IntegerField(null=True)
+
+
+def add_columns(model):
+    """
+    Добавляет в уже созданную таблицу поля модели, которых в ней ещё нет.
+    Воркеры serve.py импортируют модуль одновременно: колонку, которую успел добавить другой воркер, пропускаем.
+    """
+    if not model.table_exists():
+        return
+    existing = {column.name for column in db.get_columns(model._meta.table_name)}
+    migrator = SqliteMigrator(db)
+    for field in model._meta.sorted_fields:
+        if field.column_name in existing:
+            continue
+        try:
+            migrate(migrator.add_column(model._meta.table_name, field.column_name, field))
+        except OperationalError as error:
+            if 'duplicate column name' not in str(error):
+                raise
+
+
+add_columns(User)
+
+
+def user_by_token(token, ttl=60):
+    """
+    Пользователь по токену. Найденные пользователи хранятся ttl секунд в общем кеше воркеров,
+    неизвестные токены каждый раз проверяются по базе.
+    """
+    key = 'user:' + blake2b(token.encode(), digest_size=16).hexdigest()
+    data = shared_cache.get_json(key)
+    if data is not None:
+        return User(token=token, **data)
+    user = User.get_or_none(token=token)
+    if user is not None:
+        data = {name: value for name, value in user.__data__.items() if name != 'token'}
+        shared_cache.set_json(key, data, ttl=ttl)
+    return user
+
+
+class CrawlSummary(BaseModel):
+    store = CharField()
+    crawlid = CharField()
+    total = IntegerField(default=0)
+    in_stock = IntegerField(null=True)
+    price_min = FloatField(null=True)
+    price_q25 = FloatField(null=True)
+    price_median = FloatField(null=True)
+    price_q75 = FloatField(null=True)
+    price_max = FloatField(null=True)
+    price_mean = FloatField(null=True)
+    brands = TextField(default='{}')
+    categories = TextField(default='{}')
+    created_at = DateTimeField(default=datetime.now)
+
+    class Meta:
+        indexes = (
+            (('store', 'crawlid'), True),
+        )
+
+
+class ExportJob(BaseModel):
+    id = CharField(primary_key=True, default=lambda: uuid4().hex)
+    key = CharField(index=True)
+    store = CharField()
+    format = CharField(default='xlsx')
+    crawlid = CharField()
+    params = TextField(default='{}')
+    status = CharField(default='pending', index=True)
+    progress = IntegerField(default=0)
+    total = IntegerField(null=True)
+    path = CharField(null=True)
+    error = TextField(null=True)
+    user = IntegerField(null=True)
+    created_at = DateTimeField(default=datetime.now)
+    finished_at = DateTimeField(null=True)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,93 @@
+import hmac
+import os
+import time
+from hashlib import sha256
+from urllib.parse import quote
+from fastapi import HTTPException, Request, Response
+from fastapi.responses import FileResponse
+import compress
+
+
+class SignedLinks:
+    """
+    Подписанные ссылки на готовые файлы выгрузок: HMAC-SHA256 от пути и срока действия.
+    Ссылку можно отдать браузеру или менеджеру загрузок — токен API для скачивания не нужен.
+    """
+    def __init__(self, secret=None, ttl=60 * 60, accel=None, root='exports', key_file='download.key'):
+        """
+        :param secret: ключ подписи; если не задан — общий для всех воркеров ключ из key_file
+        :param ttl: срок действия ссылки в секундах
+        :param accel: внутренний location прокси для X-Accel-Redirect (например, /protected/exports/);
+            если не задан, файл отдаёт само приложение
+        :param root: каталог файлов, который прокси раздаёт по accel
+        :param key_file: файл ключа подписи
+        """
+        self.secret = secret.encode() if secret else None
+        self.ttl = ttl
+        self.accel = accel
+        self.root = root
+        self.key_file = key_file
+
+    def key(self) -> bytes:
+        if self.secret is None:
+            if not os.path.exists(self.key_file):
+                # ключ пишется во временный файл и ставится на место ссылкой: воркеры,
+                # стартующие одновременно, либо создают его, либо читают уже записанный
+                temp = f'{self.key_file}.{os.getpid()}'
+                with open(temp, 'wb') as file:
+                    file.write(os.urandom(32).hex().encode())
+                os.chmod(temp, 0o600)
+                try:
+                    os.link(temp, self.key_file)
+                except FileExistsError:
+                    pass
+                finally:
+                    os.remove(temp)
+            with open(self.key_file, 'rb') as file:
+                self.secret = file.read().strip()
+        return self.secret
+
+    def signature(self, path, expires) -> str:
+        return hmac.new(self.key(), f'{path}:{expires}'.encode(), sha256).hexdigest()
+
+    def sign(self, request: Request, name, ttl=None, **params) -> str:
+        """
+        Подписанная ссылка на маршрут name.
+
+        :param request: текущий запрос, от него строится абсолютный URL
+        :param name: имя маршрута
+        :param ttl: срок действия, по умолчанию self.ttl
+        """
+        url = request.url_for(name, **params)
+        expires = int(time.time()) + (ttl or self.ttl)
+        return str(url.include_query_params(expires=expires, signature=self.signature(url.path, expires)))
+
+    def verify(self, request: Request, expires: int = 0, signature: str = ''):
+        """
+        Зависимость маршрута: ссылка подписана этим ключом и не истекла.
+        """
+        if expires < time.time() or not hmac.compare_digest(signature, self.signature(request.url.path, expires)):
+            raise HTTPException(status_code=403, detail="Invalid or expired link")
+
+    def send(self, path, media_type, filename, encoding=None) -> Response:
+        """
+        Отдаёт файл: через X-Accel-Redirect, если задан accel, — тогда файл и Range
+        обслуживает прокси, — иначе FileResponse с поддержкой Range.
+
+        :param encoding: кодировка из Accept-Encoding; если рядом лежит сжатый вариант файла, отдаётся он
+        """
+        headers = {'Vary': 'Accept-Encoding'}
+        if encoding and os.path.exists(compress.variant(path, encoding)):
+            path = compress.variant(path, encoding)
+            headers['Content-Encoding'] = encoding
+        if self.accel:
+            location = self.accel.rstrip('/') + '/' + quote(os.path.relpath(path, self.root))
+            return Response(media_type=media_type, headers={
+                **headers,
+                'X-Accel-Redirect': location,
+                'Content-Disposition': f'attachment; filename="{filename}"',
+            })
+        return FileResponse(path, media_type=media_type, filename=filename, headers=headers)
+
+
+signed_links = SignedLinks(os.environ.get('DOWNLOAD_SECRET'), accel=os.environ.get('DOWNLOAD_ACCEL'))
@@ -0,0 +1,697 @@
+import asyncio
+import csv
+import glob
+import importlib
+import io
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import time
+from anyio import to_thread
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from hashlib import blake2b
+from multiprocessing import get_context
+from threading import Event, Lock, Thread
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Security
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
+from peewee import fn
+from pydantic import BaseModel, Field
+from database import db, ExportJob, user_by_token
+from downloads import signed_links
+from filters import ProductFilter
+from projection import Projection
+from ratelimit import rate_limiter
+from stats import PRICE_FIELDS, BRAND_FIELDS
+from stores import STORES
+from utils import verify_basic
+import bulkheads
+import compress
+import xlsx
+
+
+db.create_tables([ExportJob])
+
+FILTERS = ('price_min', 'price_max', 'brand', 'in_stock', 'sort')
+ACTIVE = ('pending', 'running')
+
+
+def write_csv(rows, target) -> int:
+    """
+    Пишет строки в CSV в UTF-8 с BOM, чтобы Excel открывал кириллицу.
+    Возвращает число строк товаров.
+
+    :param rows: итератор строк
+    :param target: бинарный поток
+    """
+    text = io.TextIOWrapper(target, encoding='utf-8-sig', newline='')
+    writer = csv.writer(text)
+    count = -1
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    text.detach()
+    return max(count, 0)
+
+
+class ExportFormat:
+    """
+    Формат выгрузки. Процессы пула пишут свои диапазоны строк во фрагменты (fragment),
+    затем фрагменты по порядку склеиваются в итоговый файл (assemble).
+    flat — словари и списки в строках приходят текстом, как в ячейках таблицы.
+    """
+    def __init__(self, media_type, fragment, assemble, flat=True):
+        self.media_type = media_type
+        self.fragment = fragment
+        self.assemble = assemble
+        self.flat = flat
+
+
+def csv_fragment(header, rows, file) -> int:
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+    writer = csv.writer(text)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    text.detach()
+    return count
+
+
+def csv_assemble(path, header, fragments):
+    with open(path, 'wb') as file:
+        write_csv([header], file)
+        concatenate(fragments, file)
+
+
+def ndjson_fragment(header, rows, file) -> int:
+    count = 0
+    for row in rows:
+        file.write(json.dumps(dict(zip(header, row)), ensure_ascii=False, default=str).encode())
+        file.write(b'\n')
+        count += 1
+    return count
+
+
+def ndjson_assemble(path, header, fragments):
+    with open(path, 'wb') as file:
+        concatenate(fragments, file)
+
+
+def concatenate(fragments, file):
+    for fragment in fragments:
+        with open(fragment, 'rb') as part:
+            shutil.copyfileobj(part, file)
+
+
+FORMATS = {
+    'xlsx': ExportFormat(
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        lambda header, rows, file: xlsx.write_rows(rows, file),
+        xlsx.assemble,
+    ),
+    'csv': ExportFormat('text/csv; charset=utf-8', csv_fragment, csv_assemble),
+    'ndjson': ExportFormat('application/x-ndjson', ndjson_fragment, ndjson_assemble, flat=False),
+}
+
+
+def store_router(prefix):
+    """
+    StoreRouter магазина по префиксу; модуль роутера импортируется при первом обращении.
+    """
+    for store in STORES:
+        if store.prefix == prefix:
+            return importlib.import_module(store.module).store
+    raise HTTPException(status_code=404, detail=f"Store not found: {prefix}")
+
+
+def export_params(query=None, filters: Optional[ProductFilter] = None, keys=None, projection: Optional[Projection] = None):
+    """
+    Нормализованный набор параметров выгрузки — по нему выгрузки кешируются и совпадают задачи:
+    без пустых значений, id/url отсортированы и без повторов.
+    """
+    params = {}
+    if query:
+        params['query'] = query
+    for name in FILTERS:
+        value = getattr(filters, name, None)
+        if value is not None and value != '':
+            params[name] = value
+    if keys:
+        params['ids'] = sorted(set(keys))
+    if projection:
+        params['fields'] = ','.join(projection.names)
+    return params
+
+
+def parse_params(params: dict):
+    """
+    Обратно к export_params: (query, keys, filters, projection).
+    """
+    filters = ProductFilter(**{name: params.get(name) for name in FILTERS})
+    return params.get('query'), params.get('ids'), filters, Projection(fields=params.get('fields'))
+
+
+def job_query(job: ExportJob):
+    """
+    Магазин, краул и выборка задачи: (store, crawl, products, models, schema, filters, projection).
+    """
+    store = store_router(job.store)
+    crawl = store.crawls.get(job.crawlid)
+    query, keys, filters, projection = parse_params(json.loads(job.params))
+    products, models, schema = store.export_query(crawl, filters, query, keys, projection)
+    return store, crawl, products, models, schema, filters, projection
+
+
+def plan(products, models, filters: ProductFilter, total, shards):
+    """
+    Делит выборку на shards диапазонов в её порядке. Без сортировки выборка идёт по первичному ключу
+    и делится по его значениям: ('keys', от, до) — каждый процесс читает только свой диапазон индекса.
+    С сортировкой по цене или названию — окнами ('window', offset, limit).
+    """
+    if shards <= 1 or total <= 1:
+        return [('window', 0, -1)]
+    step = math.ceil(total / shards)
+    if filters.sort is not None:
+        return [('window', offset, step) for offset in range(0, total, step)]
+    pk = models[0]._meta.primary_key
+    bounds = []
+    for offset in range(step, total, step):
+        value = products.select(pk).offset(offset).limit(1).scalar()
+        if value is not None and (not bounds or bounds[-1] != value):
+            bounds.append(value)
+    edges = [None] + bounds + [None]
+    return [('keys', low, high) for low, high in zip(edges, edges[1:])]
+
+
+def shard(products, models, bounds):
+    kind, low, high = bounds
+    if kind == 'window':
+        return products.offset(low).limit(high) if high >= 0 else products
+    pk = models[0]._meta.primary_key
+    if low is not None:
+        products = products.where(pk >= low)
+    if high is not None:
+        products = products.where(pk < high)
+    return products
+
+
+def report(rows, progress, every=1000):
+    """
+    Пропускает строки, каждые every строк сообщая progress(every), в конце — остаток.
+    """
+    count = 0
+    for row in rows:
+        yield row
+        count += 1
+        if count == every:
+            progress(count)
+            count = 0
+    if count:
+        progress(count)
+
+
+def build_shard(job_id, bounds, path):
+    """
+    Пишет диапазон строк задачи во фрагмент. Выполняется в процессе пула;
+    прогресс прибавляется прямо к ExportJob. Возвращает (заголовок или None, число строк).
+    """
+    job = ExportJob.get_by_id(job_id)
+    store, crawl, products, models, schema, _, projection = job_query(job)
+    rows = store.rows(crawl, shard(products, models, bounds), schema, projection.names or None, FORMATS[job.format].flat)
+    header = next(rows, None)
+
+    def progress(count):
+        ExportJob.update(progress=ExportJob.progress + count).where(ExportJob.id == job_id).execute()
+
+    with open(path, 'wb') as file:
+        if header is None:
+            return None, 0
+        return header, FORMATS[job.format].fragment(header, report(rows, progress), file)
+
+
+NORMALIZED = ['store', 'crawl', 'productId', 'name', 'price', 'brand', 'productUrl']
+
+
+def first(record, names):
+    return next((record[name] for name in names if name in record), None)
+
+
+def normalize(prefix, crawlid, record):
+    """
+    Строка сводного листа: общие для всех магазинов колонки NORMALIZED.
+    """
+    return [
+        prefix, crawlid, record.get('productId'), record.get('name'),
+        first(record, PRICE_FIELDS), first(record, BRAND_FIELDS), record.get('productUrl'),
+    ]
+
+
+def build_sheet(prefix, crawlid, params, base):
+    """
+    Лист магазина для сводной выгрузки. Выполняется в процессе пула и пишет три файла:
+    base.sheet.xml — строки листа магазина с заголовком, base.summary.xml и base.csv —
+    строки сводного листа. Возвращает число товаров.
+
+    :param params: поиск и фильтры из export_params
+    """
+    store = store_router(prefix)
+    crawl = store.crawls.get(crawlid)
+    query, _, filters, _ = parse_params(params)
+    products, _, schema = store.export_query(crawl, filters, query)
+    rows = store.rows(crawl, products, schema)
+    header = next(rows, None)
+    count = 0
+    # временные файлы — свои у каждого процесса, как в columnar.py
+    tmp = f'{os.getpid()}.tmp'
+    with open(f'{base}.sheet.{tmp}', 'wb') as sheet, open(f'{base}.summary.{tmp}', 'wb') as summary, \
+            open(f'{base}.csv.{tmp}', 'w', encoding='utf-8', newline='') as table:
+        writer = csv.writer(table)
+        if header is not None:
+            sheet.write(xlsx.row(header).encode())
+        for values in rows:
+            sheet.write(xlsx.row(values).encode())
+            record = normalize(prefix, crawl.crawlid, dict(zip(header, values)))
+            summary.write(xlsx.row(record).encode())
+            writer.writerow(record)
+            count += 1
+    # сжатые варианты csv склеиваются в сводный ответ так же, как сами csv
+    compress.precompress(f'{base}.csv.{tmp}', f'{base}.csv', joinable=True)
+    # sheet.xml — последним: по нему проверяется, что лист готов
+    os.replace(f'{base}.csv.{tmp}', f'{base}.csv')
+    os.replace(f'{base}.summary.{tmp}', f'{base}.summary.xml')
+    os.replace(f'{base}.sheet.{tmp}', f'{base}.sheet.xml')
+    return count
+
+
+def stream_files(head: bytes, paths, chunk_size=1024 * 1024):
+    yield head
+    for path in paths:
+        with open(path, 'rb') as file:
+            while True:
+                data = file.read(chunk_size)
+                if not data:
+                    break
+                yield data
+
+
+def parquet(paths) -> bytes:
+    """
+    Сводная таблица в Parquet из CSV-фрагментов магазинов. Нужен pyarrow.
+    """
+    try:
+        import pyarrow
+        from pyarrow import csv as pacsv, parquet as pq
+    except ImportError:
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow")
+
+    types = {name: pyarrow.string() for name in NORMALIZED}
+    types['price'] = pyarrow.float64()
+    tables = [
+        pacsv.read_csv(
+            path,
+            read_options=pacsv.ReadOptions(column_names=NORMALIZED),
+            convert_options=pacsv.ConvertOptions(column_types=types),
+        )
+        for path in paths
+    ]
+    sink = io.BytesIO()
+    pq.write_table(pyarrow.concat_tables(tables), sink)
+    return sink.getvalue()
+
+
+class ExportQueue:
+    """
+    Очередь фоновых выгрузок. Задачи хранятся в ExportJob (data.db) и переживают перезапуск.
+    Выборка задачи делится на диапазоны, которые параллельно пишут процессы общего пула,
+    потом фрагменты склеиваются по порядку. Очередь разбирает один процесс из всех воркеров —
+    тот, кто держит exports.lock (см. leader.run_as_leader). Листы сводной выгрузки тоже собираются
+    задачами очереди (format='sheet'), поэтому одинаковый лист собирается один раз и только в пуле лидера;
+    у них свои слоты, и они не ждут выгрузок пользователей.
+    """
+    def __init__(self, jobs=2, sheet_jobs=None, processes=None, shard_rows=10000, directory='exports', poll=1, ttl=24 * 60 * 60, sheet_timeout=600):
+        """
+        :param jobs: сколько выгрузок собирается одновременно
+        :param sheet_jobs: сколько листов сводной выгрузки собирается одновременно, по умолчанию — processes
+        :param processes: процессов пула, по умолчанию — по числу ядер
+        :param shard_rows: строк на диапазон; диапазонов не больше, чем processes * 4
+        :param directory: каталог готовых файлов
+        :param poll: как часто проверять новые задачи, секунды
+        :param ttl: сколько хранить готовый файл, секунды
+        :param sheet_timeout: сколько запрос сводной выгрузки ждёт сборки листов, секунды
+        """
+        self.jobs = jobs
+        self.processes = processes or os.cpu_count() or 1
+        self.sheet_jobs = sheet_jobs or self.processes
+        self.shard_rows = shard_rows
+        self.directory = directory
+        self.poll = poll
+        self.ttl = ttl
+        self.sheet_timeout = sheet_timeout
+        self.wake = Event()
+        self.running = {}
+        self.pool = None
+        self._lock = Lock()
+
+    def submit(self, store: str, format: str, crawlid: str, params: dict, user=None):
+        """
+        Ставит задачу в очередь. Если такая же задача уже ждёт, собирается или собрана и файл на месте,
+        возвращает её.
+        """
+        key = blake2b(
+            json.dumps([store, format, crawlid, params], sort_keys=True, default=str).encode(),
+            digest_size=16,
+        ).hexdigest()
+        with db.atomic('IMMEDIATE'):
+            for job in ExportJob.select().where(ExportJob.key == key).order_by(ExportJob.created_at.desc()):
+                if job.status in ACTIVE or (job.status == 'done' and job.path and os.path.exists(job.path)):
+                    return job
+            job = ExportJob.create(
+                key=key, store=store, format=format, crawlid=crawlid,
+                params=json.dumps(params, sort_keys=True, default=str), user=user,
+            )
+        self.wake.set()
+        return job
+
+    def run(self):
+        """
+        Разбирает очередь. Задачи в статусе running остались от прошлого владельца очереди,
+        который завершился, не дособрав их, — они собираются заново.
+        """
+        ExportJob.update(status='pending', progress=0).where(ExportJob.status == 'running').execute()
+        while True:
+            try:
+                self.dispatch()
+                self.expire()
+            except Exception:
+                logging.exception('Export queue failed')
+            self.wake.wait(self.poll)
+            self.wake.clear()
+
+    def dispatch(self):
+        for sheets, limit in ((False, self.jobs), (True, self.sheet_jobs)):
+            kind = (ExportJob.format == 'sheet') if sheets else (ExportJob.format != 'sheet')
+            while self.busy(sheets) < limit:
+                job = (
+                    ExportJob.select()
+                    .where((ExportJob.status == 'pending') & kind)
+                    .order_by(ExportJob.created_at)
+                    .first()
+                )
+                if job is None:
+                    break
+                ExportJob.update(status='running', progress=0).where(ExportJob.id == job.id).execute()
+                with self._lock:
+                    self.running[job.id] = job.format
+                Thread(target=self.build, args=(job.id,), daemon=True).start()
+
+    def busy(self, sheets):
+        with self._lock:
+            return sum((format == 'sheet') == sheets for format in self.running.values())
+
+    def executor(self):
+        with self._lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(self.processes, mp_context=get_context('spawn'))
+            return self.pool
+
+    def build(self, job_id):
+        try:
+            job = ExportJob.get_by_id(job_id)
+            path, count = self.sheet(job) if job.format == 'sheet' else self.export(job)
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                with self._lock:
+                    self.pool = None
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            ExportJob.update(status='failed', error=detail, finished_at=datetime.now()).where(ExportJob.id == job_id).execute()
+        else:
+            ExportJob.update(
+                status='done', path=path, progress=count, total=count, finished_at=datetime.now(),
+            ).where(ExportJob.id == job_id).execute()
+        finally:
+            with self._lock:
+                self.running.pop(job_id, None)
+            self.wake.set()
+
+    def export(self, job: ExportJob):
+        """
+        Собирает файл задачи: делит выборку на диапазоны, отдаёт их пулу и склеивает фрагменты
+        во временный файл, который переименовывается, когда готов. Возвращает (путь, число строк).
+        """
+        _, _, products, models, _, filters, _ = job_query(job)
+        total = products.count()
+        ExportJob.update(total=total).where(ExportJob.id == job.id).execute()
+        if not total:
+            raise ValueError("No products found")
+        shards = min(math.ceil(total / self.shard_rows), self.processes * 4)
+        bounds = plan(products, models, filters, total, shards)
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f'{job.id}.{job.format}')
+        parts = tempfile.mkdtemp(prefix=f'{job.id}.', dir=self.directory)
+        try:
+            fragments = [os.path.join(parts, f'{i}.part') for i in range(len(bounds))]
+            pool = self.executor()
+            futures = [pool.submit(build_shard, job.id, b, fragment) for b, fragment in zip(bounds, fragments)]
+            results = [future.result() for future in futures]
+            header = next((header for header, _ in results if header is not None), None)
+            count = sum(count for _, count in results)
+            if not count:
+                raise ValueError("No products found")
+            tmp = os.path.join(parts, 'export.tmp')
+            FORMATS[job.format].assemble(tmp, header, fragments)
+            if compress.compressible(FORMATS[job.format].media_type, os.path.getsize(tmp)):
+                compress.precompress(tmp, path)
+            os.replace(tmp, path)
+        finally:
+            shutil.rmtree(parts, ignore_errors=True)
+        return path, count
+
+    def sheet_base(self, prefix, crawlid, params: dict):
+        """
+        Путь листа магазина без расширения: {магазин}.{хеш краула}.{хеш параметров} в exports/sheets.
+        """
+        directory = os.path.join(self.directory, 'sheets')
+        crawl = blake2b(str(crawlid).encode(), digest_size=8).hexdigest()
+        variant = blake2b(json.dumps(params, sort_keys=True).encode(), digest_size=8).hexdigest()
+        return os.path.join(directory, f'{prefix}.{crawl}.{variant}')
+
+    def sheet(self, job: ExportJob):
+        """
+        Собирает лист сводной выгрузки в пуле. Возвращает (путь sheet.xml, число строк).
+        """
+        base = self.sheet_base(job.store, job.crawlid, json.loads(job.params))
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        count = self.executor().submit(build_sheet, job.store, job.crawlid, json.loads(job.params), base).result()
+        return f'{base}.sheet.xml', count
+
+    def plan_sheets(self, params: dict):
+        """
+        Листы магазинов с выгрузками для сводной выгрузки: ([(магазин, краул, путь без расширения)],
+        {id задачи: магазин}, [сбойные магазины]). Лист собирается, только если для последнего краула
+        магазина и этих параметров его ещё нет, — тогда он ставится в очередь и попадает в задачи.
+        Листы прошлых краулов удаляет expire вместе с их задачами.
+
+        :param params: поиск и фильтры из export_params
+        """
+        sheets, waiting, failed = [], {}, []
+        for entry in STORES:
+            try:
+                store = importlib.import_module(entry.module).store
+                if not store.spec.export:
+                    continue
+                crawl = store.crawls.current()
+                if crawl is None:
+                    continue
+                base = self.sheet_base(entry.prefix, crawl.crawlid, params)
+                if not os.path.exists(f'{base}.sheet.xml'):
+                    waiting[self.submit(entry.prefix, 'sheet', crawl.crawlid, params).id] = entry
+            except Exception:
+                logging.exception('Sheet of %s failed', entry.prefix)
+                failed.append(entry.prefix)
+                continue
+            sheets.append((entry, crawl, base))
+        return sheets, waiting, failed
+
+    async def sheets(self, params: dict):
+        """
+        Листы для сводной выгрузки: ([(магазин, краул, путь без расширения)], [сбойные магазины]).
+        Задачи листов запрос ждёт асинхронно, не дольше sheet_timeout, не занимая поток.
+        Магазин, который не удалось загрузить или собрать, в выгрузку не попадает и возвращается среди сбойных.
+
+        :param params: поиск и фильтры из export_params
+        """
+        sheets, waiting, failed = await to_thread.run_sync(self.plan_sheets, params)
+        deadline = time.monotonic() + self.sheet_timeout
+        while waiting:
+            jobs = await to_thread.run_sync(lambda: list(ExportJob.select().where(ExportJob.id.in_(list(waiting)))))
+            for job in jobs:
+                if job.status == 'done':
+                    del waiting[job.id]
+                elif job.status not in ACTIVE:
+                    logging.error('Sheet of %s failed: %s', job.store, job.error)
+                    failed.append(waiting.pop(job.id).prefix)
+            if waiting and time.monotonic() > deadline:
+                logging.error('Sheets timed out: %s', ', '.join(entry.prefix for entry in waiting.values()))
+                failed += [entry.prefix for entry in waiting.values()]
+                break
+            if waiting:
+                await asyncio.sleep(self.poll)
+        sheets = [sheet for sheet in sheets if sheet[0].prefix not in failed]
+        return [sheet for sheet in sheets if os.path.getsize(f'{sheet[2]}.csv')], failed
+
+    def expire(self):
+        """
+        Удаляет файлы выгрузок и листов сводной выгрузки старше ttl. Выполняется только у лидера очереди:
+        воркеры могут по-разному видеть текущий краул и удалять файлы, которые отдаёт соседний воркер.
+        """
+        expired = ExportJob.select().where(
+            (ExportJob.status == 'done') & (ExportJob.finished_at < datetime.now() - timedelta(seconds=self.ttl)))
+        for job in expired:
+            ExportJob.update(status='expired').where(ExportJob.id == job.id).execute()
+            # файлы на месте могли собрать заново более поздней задачей с тем же ключом
+            newer = ExportJob.select().where(
+                (ExportJob.key == job.key) & (ExportJob.status == 'done') & (ExportJob.finished_at > job.finished_at))
+            if newer.exists():
+                continue
+            if job.format == 'sheet':
+                for path in glob.glob(glob.escape(job.path[:-len('.sheet.xml')]) + '.*'):
+                    compress.remove(path)
+            else:
+                compress.remove(job.path)
+
+    def metrics(self):
+        counts = ExportJob.select(ExportJob.status, fn.COUNT(ExportJob.id)).group_by(ExportJob.status).tuples()
+        return {'processes': self.processes, 'running': len(self.running), 'jobs': dict(counts)}
+
+
+export_queue = ExportQueue()
+
+
+class ExportRequest(BaseModel):
+    store: str = Field(description="Префикс магазина: vvp, logic, citilink...")
+    format: Literal['xlsx', 'csv', 'ndjson'] = 'xlsx'
+    crawl: Optional[str] = Field(None, description="ID краула или дата ISO 8601; по умолчанию — последний законченный")
+    query: Optional[str] = Field(None, description="Подстрока названия")
+    price_min: Optional[float] = Field(None, ge=0)
+    price_max: Optional[float] = Field(None, ge=0)
+    brand: Optional[str] = None
+    in_stock: Optional[bool] = None
+    sort: Optional[Literal['price', '-price', 'name']] = None
+    ids: Optional[List[str]] = Field(None, description="id или url товаров — как у выборки по id/url магазина")
+    fields: Optional[str] = Field(None, description="Колонки через запятую, например: productId,price")
+
+
+app = APIRouter()
+security = HTTPBearer()
+
+
+def get_current_user(request: Request, token: HTTPAuthorizationCredentials = Security(security)):
+    """
+    Проверка Bearer токена.
+
+    :param credentials: HTTPAuthorizationCredentials
+    :raises HTTPException: Если токен невалиден или отсутствует
+    """
+    user = user_by_token(token.credentials)
+    if user is None:
+        raise HTTPException(status_code=403, detail="Could not validate credentials")
+    rate_limiter.check_user(request, user)
+    return {"username": user.name, 'item': user.get_id()}
+
+
+def job_status(request: Request, job: ExportJob):
+    status = {
+        'id': job.id,
+        'store': job.store,
+        'format': job.format,
+        'crawl': job.crawlid,
+        'params': json.loads(job.params),
+        'status': job.status,
+        'progress': job.progress,
+        'total': job.total,
+        'error': job.error,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+    }
+    if job.status == 'done' and job.format in FORMATS:
+        status['download'] = signed_links.sign(request, 'download_export', job_id=job.id)
+    return status
+
+
+@app.post("", status_code=202)
+def create_export(request: Request, body: ExportRequest, user: dict = Depends(get_current_user)):
+    store = store_router(body.store)
+    if not store.spec.export:
+        raise HTTPException(status_code=404, detail=f"Store has no exports: {body.store}")
+    crawl = store.crawls.get(body.crawl) if body.crawl else store.crawls.current()
+    if crawl is None:
+        raise HTTPException(status_code=404, detail="No products found")
+    filters = ProductFilter(**body.model_dump(include=set(FILTERS)))
+    projection = Projection(fields=body.fields)
+    # неизвестные колонки — 400 сразу, а не ошибкой задачи
+    store.export_query(crawl, filters, body.query, body.ids, projection)
+    params = export_params(body.query, filters, body.ids, projection)
+    job = export_queue.submit(body.store, body.format, crawl.crawlid, params, user=user['item'])
+    return job_status(request, job)
+
+
+@bulkheads.exports
+def parquet_response(paths, headers):
+    return Response(parquet(paths), media_type='application/vnd.apache.parquet', headers=headers)
+
+
+@app.get("/all.{format}")
+async def get_all(request: Request, format: Literal['xlsx', 'csv', 'parquet'], query: Optional[str] = None, filters: ProductFilter = Depends(), credentials: HTTPBasicCredentials = Depends(verify_basic)):
+    """
+    Сводная выгрузка всех магазинов: в xlsx — сводный лист и по листу на магазин,
+    в csv и parquet — сводная таблица. Поиск и фильтры — как у /products/ магазинов.
+    Магазины, лист которых собрать не удалось, перечислены в X-Failed-Stores.
+    Листы собирает очередь выгрузок; пока они собираются, запрос не занимает поток пула exports.
+    """
+    sheets, failed = await export_queue.sheets(export_params(query, filters))
+    if not sheets:
+        raise HTTPException(status_code=404, detail="No products found")
+    headers = {"Content-Disposition": f"attachment; filename=all.{format}"}
+    if failed:
+        headers['X-Failed-Stores'] = ','.join(failed)
+    if format == 'xlsx':
+        book = [xlsx.Sheet('Все магазины', NORMALIZED, [f'{base}.summary.xml' for _, _, base in sheets])]
+        book += [xlsx.Sheet(entry.tag, None, [f'{base}.sheet.xml']) for entry, _, base in sheets]
+        return StreamingResponse(xlsx.book(book), media_type=FORMATS['xlsx'].media_type, headers=headers)
+    paths = [f'{base}.csv' for _, _, base in sheets]
+    if format == 'csv':
+        head = ('\ufeff' + ','.join(NORMALIZED) + '\r\n').encode()
+        # сжатый ответ склеивается из готовых сжатых листов
+        encoding = compress.negotiate(request.headers.get('accept-encoding'))
+        headers['Vary'] = 'Accept-Encoding'
+        if encoding and all(os.path.exists(compress.variant(path, encoding, joinable=True)) for path in paths):
+            headers['Content-Encoding'] = encoding
+            return StreamingResponse(compress.join(head, paths, encoding), media_type=FORMATS['csv'].media_type, headers=headers)
+        return StreamingResponse(stream_files(head, paths), media_type=FORMATS['csv'].media_type, headers=headers)
+    return await parquet_response(paths, headers)
+
+
+@app.get("/{job_id}")
+def get_export(request: Request, job_id: str, user: dict = Depends(get_current_user)):
+    job = ExportJob.get_or_none(ExportJob.id == job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Export not found")
+    return job_status(request, job)
+
+
+@app.get("/{job_id}/download", name='download_export', dependencies=[Depends(signed_links.verify)])
+def download_export(request: Request, job_id: str):
+    job = ExportJob.get_or_none(ExportJob.id == job_id)
+    if job is None or job.status != 'done' or job.format not in FORMATS or not os.path.exists(job.path):
+        raise HTTPException(status_code=404, detail="Export not found")
+    # докачка по Range — всегда по несжатому файлу, иначе куски разных представлений не сходятся
+    encoding = None if 'range' in request.headers else compress.negotiate(request.headers.get('accept-encoding'))
+    return signed_links.send(job.path, FORMATS[job.format].media_type, f'{job.store}-{job.crawlid}.{job.format}', encoding)
@@ -0,0 +1,112 @@
+from typing import Literal, Optional
+from fastapi import Query
+from peewee import BooleanField, IntegerField, FloatField, DecimalField, fn
+from stats import find_field, PRICE_FIELDS, BRAND_FIELDS, STOCK_FIELDS, NO_STOCK
+
+
+NUMERIC_FIELDS = (IntegerField, FloatField, DecimalField)
+
+
+class ProductFilter:
+    """
+    Фильтры и сортировка для /products/ и /products/search/.
+    """
+    def __init__(
+        self,
+        price_min: Optional[float] = Query(None, ge=0),
+        price_max: Optional[float] = Query(None, ge=0),
+        brand: Optional[str] = None,
+        in_stock: Optional[bool] = None,
+        sort: Optional[Literal['price', '-price', 'name']] = None,
+    ):
+        self.price_min = price_min
+        self.price_max = price_max
+        self.brand = brand
+        self.in_stock = in_stock
+        self.sort = sort
+
+    @property
+    def active(self):
+        return any(v is not None for v in (self.price_min, self.price_max, self.brand, self.in_stock))
+
+    def apply(self, query, models):
+        """
+        Добавляет условия и сортировку к выборке.
+
+        :param query: выборка товаров
+        :param models: модели выборки, в которых ищутся поля цены, бренда и наличия
+        """
+        price = find_field(models, PRICE_FIELDS)
+        brand = find_field(models, BRAND_FIELDS)
+        stock = find_field(models, STOCK_FIELDS)
+
+        if price is not None:
+            if self.price_min is not None:
+                query = query.where(price >= self.price_min)
+            if self.price_max is not None:
+                query = query.where(price <= self.price_max)
+        if brand is not None and self.brand:
+            query = query.where(brand == self.brand)
+        if stock is not None and self.in_stock is not None:
+            query = query.where(stock_condition(stock, self.in_stock))
+
+        name = find_field(models, ('name',))
+        order = []
+        if self.sort == 'price' and price is not None:
+            order = [price.asc()]
+        elif self.sort == '-price' and price is not None:
+            order = [price.desc()]
+        elif self.sort == 'name' and name is not None:
+            order = [name.asc()]
+        # первичный ключ последним: стабильный порядок страниц внутри одного краула
+        # и при равных ценах и названиях — тот же, что у колоночного снимка
+        return query.order_by(*order, models[0]._meta.primary_key)
+
+
+def stock_condition(field, in_stock: bool):
+    if isinstance(field, BooleanField):
+        return field == in_stock
+    if isinstance(field, NUMERIC_FIELDS):
+        return (field > 0) if in_stock else ((field <= 0) | field.is_null())
+    empty = fn.LOWER(fn.TRIM(field)).in_(NO_STOCK)
+    return ~empty & field.is_null(False) if in_stock else (empty | field.is_null())
+
+
+def ensure_indexes(model):
+    """
+    Создаёт индексы под фильтры и сортировки /products/ в рамках краула:
+    (crawlid), (crawlid, price), (crawlid, brand, price), (crawlid, stock, price), (crawlid, name).
+    Для моделей без crawlid индексы строятся без него.
+
+    :param model: модель товара парсера
+    """
+    crawlid = model._meta.fields.get('crawlid')
+    price = find_field([model], PRICE_FIELDS)
+    brand = find_field([model], BRAND_FIELDS)
+    stock = find_field([model], STOCK_FIELDS)
+    name = find_field([model], ('name',))
+
+    prefix = [crawlid] if crawlid is not None else []
+    indexes = [
+        prefix,
+        prefix + [price],
+        prefix + [brand, price],
+        prefix + [stock, price],
+        prefix + [name],
+    ]
+    for fields in indexes:
+        if not fields or any(f is None for f in fields):
+            continue
+        create_index(model, fields)
+
+
+def create_index(model, fields):
+    """
+    CREATE INDEX IF NOT EXISTS по полям модели (таблицы парсеров создаются не этим приложением).
+    """
+    table = model._meta.table_name
+    columns = [f.column_name for f in fields]
+    index_name = '_'.join(['api', table] + columns)
+    model._meta.database.execute_sql(
+        'CREATE INDEX IF NOT EXISTS "%s" ON "%s" (%s)'
+        % (index_name, table, ', '.join('"%s"' % c for c in columns)))
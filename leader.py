@@ -0,0 +1,27 @@
+import fcntl
+import logging
+import os
+import time
+
+
+def run_as_leader(path, target, pause=5):
+    """
+    Запускает target только в одном процессе из всех, кто вызвал функцию с тем же path.
+    Лидер держит flock на файле; остальные ждут его освобождения — ОС снимает блокировку,
+    когда процесс лидера завершается, и target подхватывает следующий.
+
+    :param path: файл блокировки
+    :param target: функция, которую выполняет лидер (например, bot.infinity_polling)
+    :param pause: пауза перед повторным захватом, если target завершился
+    """
+    while True:
+        with open(path, 'a+') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            lock.truncate(0)
+            lock.write(str(os.getpid()))
+            lock.flush()
+            try:
+                target()
+            except Exception:
+                logging.exception('Leader task %s failed', path)
+        time.sleep(pause)
@@ -1,28 +1,50 @@
 import json
 from fastapi import FastAPI
 from threading import Thread
-import ozon, citilink, wildberries, mvideo, \
-    norbel, resurs_media, absolut_trade, \
-        pronet, f5it, logic, vvp, store77
 from bot import bot
+from leader import run_as_leader
+from crawls import crawl_headers
+from cache import CacheHit, cache_hit, cache_responses, response_cache
+from bulkheads import bulkheads
+from stores import mount_stores
+from admission import admission
+from ratelimit import rate_limit_headers
+import exports
 
 
 app = FastAPI()
+app.middleware('http')(cache_responses)
+app.middleware('http')(crawl_headers)
+app.middleware('http')(rate_limit_headers)
+app.middleware('http')(admission)
+app.add_exception_handler(CacheHit, cache_hit)
 
-# Include routers with prefixes
-app.include_router(ozon.app, prefix="/ozon", tags=["Ozon"])
-app.include_router(citilink.app, prefix="/citilink", tags=["Citilink"])
-app.include_router(wildberries.app, prefix="/wb", tags=["Wildberries"])
-app.include_router(mvideo.app, prefix="/mvideo", tags=["MVideo"])
-app.include_router(norbel.app, prefix="/norbel", tags=["Norbel"])
-app.include_router(resurs_media.app, prefix="/resurs-media", tags=["Resurs-Media"])
-app.include_router(absolut_trade.app, prefix="/absolut-trade", tags=["Elko"])
-app.include_router(pronet.app, prefix="/pronet", tags=["ProNet"])
-app.include_router(f5it.app, prefix="/f5it", tags=["F5IT"])
-app.include_router(logic.app, prefix="/logic", tags=["3Logic"])
-app.include_router(vvp.app, prefix="/vvp", tags=["VVP"])
-app.include_router(store77.app, prefix="/store77", tags=["Store77"])
-
-Thread(target=bot.infinity_polling, daemon=True).start()
+# Роутеры магазинов импортируются при первом запросе к их префиксу
+mount_stores(app)
+app.include_router(exports.app, prefix="/exports", tags=["Exports"])
+
+
+@app.get("/metrics/cache", tags=["Metrics"])
+def get_cache_metrics():
+    return response_cache.metrics()
+
+
+@app.get("/metrics/pools", tags=["Metrics"])
+def get_pool_metrics():
+    return {name: pool.metrics() for name, pool in bulkheads.items()}
+
+
+@app.get("/metrics/admission", tags=["Metrics"])
+def get_admission_metrics():
+    return admission.metrics()
+
+
+@app.get("/metrics/exports", tags=["Metrics"])
+def get_export_metrics():
+    return exports.export_queue.metrics()
+
+# в нескольких воркерах бота опрашивает только один — тот, кто держит bot.lock
+Thread(target=run_as_leader, args=('bot.lock', bot.infinity_polling), daemon=True).start()
+Thread(target=run_as_leader, args=('exports.lock', exports.export_queue.run), daemon=True).start()
 
  
\ No newline at end of file
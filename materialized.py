@@ -0,0 +1,142 @@
+import fcntl
+import logging
+import time
+from datetime import datetime
+from threading import Lock, Thread
+from peewee import Model, CharField, IntegerField, BareField, DateTimeField, fn
+
+
+# повтор обновления, секунды: пока его ведёт другой процесс и после ошибки
+RETRY_BUSY = 5
+RETRY_FAILED = 60
+
+
+def latest_details_models(database):
+    """
+    api_latest_details: одна строка на URL — цена из последнего краула и id последней строки деталей.
+    api_latest_details_state: до какого краула и какой строки деталей таблица доведена.
+    """
+    class LatestDetails(Model):
+        productUrl = CharField(primary_key=True)
+        crawlid = CharField(null=True, index=True)
+        price = BareField(null=True)
+        details_id = IntegerField(null=True)
+
+        class Meta:
+            table_name = 'api_latest_details'
+
+    class LatestDetailsState(Model):
+        crawlid = CharField()
+        crawl_created_at = DateTimeField()
+        watermark = IntegerField(default=0)
+        updated_at = DateTimeField(default=datetime.now)
+
+        class Meta:
+            table_name = 'api_latest_details_state'
+
+    LatestDetails.bind(database)
+    LatestDetailsState.bind(database)
+    database.create_tables([LatestDetails, LatestDetailsState])
+    return LatestDetails, LatestDetailsState
+
+
+class LatestDetailsView:
+    """
+    Материализованная проекция «актуальные детали + последняя цена» по productUrl.
+    Обновляется инкрементально при появлении нового законченного краула:
+    цены берутся из строк этого краула, детали — только из строк, добавленных после прошлого обновления.
+    Обновление идёт в фоне и только в одном процессе (под flock): запросы не ждут блокировку записи в базе парсера.
+    """
+    def __init__(self, product, details, lock_path='latest_details.lock'):
+        self.product = product
+        self.details = details
+        self.model, self.state_model = latest_details_models(product._meta.database)
+        self.lock_path = lock_path
+        self._lock = Lock()
+        self._refreshing = None
+        self._retry = 0
+
+    def state(self):
+        return self.state_model.select().order_by(self.state_model.id.desc()).first()
+
+    def ready(self, crawl):
+        """
+        Можно ли читать данные краула из проекции. Если проекция отстала от краула,
+        запускает её обновление в фоне; до его конца, как и для краулов старше материализованного,
+        возвращает False — данные читают из исходных таблиц.
+        """
+        state = self.state()
+        if state is not None and state.crawlid == str(crawl.crawlid):
+            return True
+        if state is None or state.crawl_created_at < crawl.created_at:
+            with self._lock:
+                if self._refreshing is None and self._retry <= time.monotonic():
+                    self._refreshing = crawl.crawlid
+                    Thread(target=self.update, args=(crawl,), daemon=True).start()
+        return False
+
+    def update(self, crawl):
+        try:
+            with open(self.lock_path, 'w') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self._retry = time.monotonic() + RETRY_BUSY
+                    return
+                state = self.state()
+                if state is None or state.crawl_created_at < crawl.created_at:
+                    self.refresh(crawl, state)
+        except Exception:
+            self._retry = time.monotonic() + RETRY_FAILED
+            logging.exception('Latest details refresh for crawl %s failed', crawl.crawlid)
+        finally:
+            with self._lock:
+                self._refreshing = None
+
+    def refresh(self, crawl, state=None):
+        Latest, Product, Details = self.model, self.product, self.details
+        watermark = state.watermark if state is not None else 0
+        with Latest._meta.database.atomic('IMMEDIATE'):
+            prices = Product.select(Product.productUrl, Product.crawlid, Product.price)
+            if state is None:
+                # первое заполнение: последняя цена каждого URL из краулов не новее этого
+                last = Product.select(fn.MAX(Product.id)).where(Product.crawlid == crawl.crawlid)
+                prices = prices.where(Product.id.in_(
+                    Product.select(fn.MAX(Product.id)).where(Product.id <= last).group_by(Product.productUrl)))
+            else:
+                prices = prices.where(Product.crawlid == crawl.crawlid)
+            (Latest
+             .insert_from(prices, [Latest.productUrl, Latest.crawlid, Latest.price])
+             .on_conflict(conflict_target=[Latest.productUrl], preserve=[Latest.crawlid, Latest.price])
+             .execute())
+
+            top = Details.select(fn.MAX(Details.id)).scalar() or watermark
+            details = (
+                Details
+                .select(Details.productUrl, fn.MAX(Details.id))
+                .where((Details.id > watermark) & (Details.id <= top))
+                .group_by(Details.productUrl)
+            )
+            (Latest
+             .insert_from(details, [Latest.productUrl, Latest.details_id])
+             .on_conflict(conflict_target=[Latest.productUrl], preserve=[Latest.details_id])
+             .execute())
+
+            self.state_model.create(crawlid=str(crawl.crawlid), crawl_created_at=crawl.created_at, watermark=top)
+
+    def select(self, crawl=None):
+        """
+        Цена и детали из проекции, как в прежнем join ProductDetails × Product:
+        URL без строки товара (crawlid пуст — были только детали) не попадают.
+
+        :param crawl: если указан — только товары, бывшие в этом крауле
+        """
+        columns = [field for field in self.details._meta.sorted_fields if field.name != 'price']
+        query = (
+            self.model
+            .select(self.model.price, *columns)
+            .join(self.details, on=(self.details.id == self.model.details_id))
+        )
+        if crawl is not None:
+            return query.where(self.model.crawlid == str(crawl.crawlid))
+        return query.where(self.model.crawlid.is_null(False))
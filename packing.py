@@ -0,0 +1,85 @@
+from datetime import date, time
+from decimal import Decimal
+from functools import lru_cache
+from uuid import UUID
+from fastapi import Request, Response
+from pydantic_core import PydanticUndefined
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack')
+JSON_TYPES = ('application/json', 'application/*', '*/*')
+
+
+def accepts_msgpack(request: Request) -> bool:
+    """
+    Зависимость эндпоинтов товаров: клиент просит MessagePack в Accept и ставит его не ниже JSON.
+    Без Accept и без установленного msgpack — JSON.
+    """
+    if msgpack is None:
+        return False
+    weights = {}
+    for item in request.headers.get('accept', '').split(','):
+        media_type, _, params = item.strip().partition(';')
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[media_type.strip().lower()] = q
+    packed = max(weights.get(media_type, 0) for media_type in MEDIA_TYPES)
+    return packed > 0 and packed >= max(weights.get(media_type, 0) for media_type in JSON_TYPES)
+
+
+def encode(value):
+    # типы, которых нет в MessagePack, — так же, как их пишет JSON-ответ
+    if isinstance(value, (date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if hasattr(value, 'model_dump'):
+        return value.model_dump(mode='json', by_alias=True)
+    raise TypeError(f"Cannot serialize {type(value).__name__} to MessagePack")
+
+
+class MsgpackResponse(Response):
+    media_type = MEDIA_TYPES[0]
+
+    def render(self, content) -> bytes:
+        return msgpack.packb(content, default=encode, use_bin_type=True, datetime=False)
+
+
+@lru_cache(maxsize=None)
+def schema_fields(schema):
+    """
+    Поля схемы ответа: (ключ в строке выборки, ключ в ответе, значение по умолчанию).
+    """
+    fields = []
+    for name, field in schema.model_fields.items():
+        source = field.validation_alias if isinstance(field.validation_alias, str) else field.alias or name
+        default = None if field.default is PydanticUndefined else field.default
+        fields.append((source, field.serialization_alias or field.alias or name, default))
+    return tuple(fields)
+
+
+def pack(rows, schema, reform=None, headers=None) -> MsgpackResponse:
+    """
+    Строки выборки (.dicts()) в ответ MessagePack по полям схемы, без построения модели на строку.
+
+    :param reform: разбор JSON-колонок роутера магазина
+    """
+    fields = schema_fields(schema)
+    if reform is not None:
+        rows = map(reform, rows)
+    return MsgpackResponse([{key: row.get(source, default) for source, key, default in fields} for row in rows], headers=headers)
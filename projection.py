@@ -0,0 +1,50 @@
+from typing import Optional
+from fastapi import HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from stats import find_field
+from packing import MsgpackResponse
+
+
+class Projection:
+    """
+    Параметр fields= для эндпоинтов товаров: читаются и отдаются только указанные колонки.
+    """
+    def __init__(self, fields: Optional[str] = Query(None, description="Через запятую, например: productId,price")):
+        self.names = list(dict.fromkeys(name.strip() for name in (fields or '').split(',') if name.strip()))
+
+    def __bool__(self):
+        return bool(self.names)
+
+    def columns(self, models, schema):
+        """
+        Поля моделей для запрошенных имён.
+
+        :param models: модели выборки (в порядке приоритета)
+        :param schema: схема ответа эндпоинта, ограничивающая допустимые имена
+        :raises HTTPException: Если поле не входит в схему ответа
+        """
+        columns = []
+        for name in self.names:
+            field = find_field(models, (name,)) if name in schema.model_fields else None
+            if field is None:
+                raise HTTPException(status_code=400, detail=f"Unknown field: {name}")
+            columns.append(field.alias(name))
+        return columns
+
+    def response(self, query, models, schema, reform=None, not_found=None, packed=False, headers=None):
+        """
+        Выполняет выборку только по запрошенным колонкам, минуя построение схемы.
+
+        :param not_found: текст ошибки 404 для пустой выборки; без него отдаётся пустой список
+        :param packed: ответ в MessagePack вместо JSON
+        :param headers: заголовки ответа, выставленные эндпоинтом (например, X-Total-Count)
+        """
+        rows = list(query.select(*self.columns(models, schema)).dicts())
+        if not rows and not_found:
+            raise HTTPException(status_code=404, detail=not_found)
+        if reform is not None:
+            rows = [reform(row) for row in rows]
+        if packed:
+            return MsgpackResponse(rows, headers=headers)
+        return JSONResponse(content=jsonable_encoder(rows), headers=headers)
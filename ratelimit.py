@@ -0,0 +1,76 @@
+import math
+import time
+from threading import Lock
+from fastapi import HTTPException, Request
+
+
+EXPENSIVE_SUFFIXES = ('/stats', '/facets', '.xlsx', '.csv', '.parquet', '/exports')
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов по пользователю: token bucket в памяти процесса,
+    отдельные корзины для дешёвых запросов и дорогих (агрегаты и выгрузки).
+    Лимиты — запросов в минуту; у пользователя они берутся из User, иначе — значения по умолчанию.
+    """
+    def __init__(self, cheap=120, expensive=10, period=60):
+        """
+        :param cheap: запросов в период для страниц, поиска и выборок по id/url
+        :param expensive: запросов в период для stats/facets и выгрузок
+        :param period: период, секунды
+        """
+        self.defaults = {'cheap': cheap, 'expensive': expensive}
+        self.period = period
+        self.buckets = {}
+        self._lock = Lock()
+
+    def take(self, key, limit):
+        """
+        Забирает токен из корзины. Возвращает (допущен ли, осталось токенов, секунд до ответа).
+        Для допущенного — секунд до полной корзины, для отклонённого — до следующего токена.
+        """
+        rate = limit / self.period
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self.buckets.get(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+        wait = (limit - tokens) / rate if allowed else (1 - tokens) / rate
+        return allowed, int(tokens), math.ceil(wait)
+
+    def check(self, request: Request, key, cheap=None, expensive=None):
+        """
+        Учитывает запрос; при исчерпанной корзине отвечает 429.
+
+        :param key: чей запрос (пользователь или логин выгрузок)
+        :param cheap: лимит дешёвых запросов, если у пользователя свой
+        :param expensive: лимит дорогих запросов, если у пользователя свой
+        """
+        kind = 'expensive' if request.url.path.endswith(EXPENSIVE_SUFFIXES) else 'cheap'
+        limit = {'cheap': cheap, 'expensive': expensive}[kind] or self.defaults[kind]
+        allowed, remaining, reset = self.take((key, kind), limit)
+        headers = {
+            'RateLimit-Limit': str(limit),
+            'RateLimit-Remaining': str(remaining),
+            'RateLimit-Reset': str(reset),
+        }
+        if not allowed:
+            raise HTTPException(status_code=429, detail="Rate limit exceeded", headers={**headers, 'Retry-After': str(reset)})
+        request.state.rate_limit = headers
+
+    def check_user(self, request: Request, user):
+        self.check(request, f'user:{user.get_id()}', user.rate_limit, user.expensive_rate_limit)
+
+
+rate_limiter = RateLimiter()
+
+
+async def rate_limit_headers(request: Request, call_next):
+    response = await call_next(request)
+    headers = getattr(request.state, 'rate_limit', None)
+    if headers is not None:
+        response.headers.update(headers)
+    return response
@@ -0,0 +1,477 @@
+import json
+import types
+import typing
+from io import BytesIO
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, Security
+from fastapi.security import HTTPBasicCredentials, HTTPBearer, HTTPAuthorizationCredentials
+from peewee import fn
+from database import user_by_token
+from crawls import CrawlCatalog
+from cache import response_cache
+from bulkheads import bulkhead, exports, inline
+from ratelimit import rate_limiter
+from columnar import ColumnarStore
+from materialized import LatestDetailsView
+from projection import Projection
+from filters import ProductFilter, ensure_indexes, create_index
+from utils import verify_basic
+from stats import get_summary, summary_stats, summary_facets, find_field
+from exports import FORMATS, write_csv
+from packing import accepts_msgpack, pack, MsgpackResponse
+
+
+# разбор параметров — в цикле событий; зависимости с базой выполняются в пуле магазина (StoreRouter)
+filter_params = inline(ProductFilter)
+projection_params = inline(Projection)
+msgpack_param = inline(accepts_msgpack)
+import xlsx
+
+
+SCALARS = (str, int, float, bool, type(None))
+
+
+def json_columns(schema):
+    """
+    Поля схемы, которые парсеры хранят строкой JSON: всё, что не объявлено строкой или числом.
+    """
+    columns = []
+    for name, field in schema.model_fields.items():
+        annotation = field.annotation
+        if typing.get_origin(annotation) in (typing.Union, types.UnionType):
+            args = typing.get_args(annotation)
+        else:
+            args = (annotation,)
+        if not all(arg in SCALARS for arg in args):
+            columns.append(name)
+    return tuple(columns)
+
+
+def flatten(value):
+    """
+    Значение для ячейки xlsx: словари — строками «ключ: значение», списки — построчно.
+    """
+    if isinstance(value, dict):
+        return '\n'.join(f'{k}: {v}' for k, v in value.items())
+    if isinstance(value, list):
+        return '\n'.join(map(str, value))
+    return value
+
+
+class StoreSpec:
+    """
+    Описание магазина для StoreRouter: модели, схемы и форма выборок.
+    """
+    def __init__(
+        self,
+        prefix,
+        product,
+        schema,
+        crawls: CrawlCatalog,
+        details=None,
+        details_schema=None,
+        join='productId',
+        details_in_lists=False,
+        latest_details=False,
+        materialized=False,
+        lookup='productId',
+        lookup_scoped=True,
+        lookup_columns=None,
+        export_columns=None,
+        empty_not_found=False,
+        search_limit=10,
+        distinct=None,
+        json_columns=None,
+        export=True,
+        export_updated=False,
+        columnar=False,
+    ):
+        """
+        :param prefix: префикс магазина (ключ сводок и имя пула)
+        :param product: модель товара парсера
+        :param schema: схема ответа списков и поиска
+        :param crawls: каталог краулов (CrawlCatalog или SnapshotCatalog)
+        :param details: модель деталей товара, если есть
+        :param details_schema: схема ответа выборки по id/url и выгрузки, если есть детали
+        :param join: поле, по которому детали связаны с товаром
+        :param details_in_lists: списки и поиск тоже отдают товар вместе с деталями
+        :param latest_details: детали дописываются журналом — берётся последняя строка по join
+        :param materialized: выборка по url и выгрузка читают LatestDetailsView
+        :param lookup: поле выборки: productId — /products/by_ids/, productUrl — /products/by_url/
+        :param lookup_scoped: выборка ограничена краулом; иначе — последние детали по полю
+        :param lookup_columns: поля товара, которые выборка по id/url берёт к деталям, например ('price',);
+            None — все поля товара, при совпадении имён с деталями побеждает товар
+        :param export_columns: то же для выгрузки
+        :param empty_not_found: пустые список и поиск отвечают 404, а не []
+        :param search_limit: limit поиска по умолчанию; None — все найденные товары
+        :param distinct: поле, по которому поиск оставляет одну строку
+        :param json_columns: колонки со строками JSON, которые разбираются в ответе; True — все нестроковые поля схемы
+        :param export: есть ли /products/output.xlsx
+        :param export_updated: добавлять в выгрузку колонку с датой краула
+        :param columnar: отдавать списки и by_ids из снимка ColumnarStore
+        """
+        self.prefix = prefix
+        self.product = product
+        self.schema = schema
+        self.crawls = crawls
+        self.details = details
+        self.details_schema = details_schema or schema
+        self.join = join
+        self.details_in_lists = details_in_lists
+        self.latest_details = latest_details
+        self.materialized = materialized
+        self.lookup = lookup
+        self.lookup_scoped = lookup_scoped
+        self.lookup_columns = lookup_columns
+        self.export_columns = export_columns
+        self.empty_not_found = empty_not_found
+        self.search_limit = search_limit
+        self.distinct = distinct
+        self.json_columns = json_columns
+        self.export = export
+        self.export_updated = export_updated
+        self.columnar = columnar
+
+
+class StoreRouter:
+    """
+    Роутер магазина по StoreSpec: одни и те же эндпоинты, выборки, кеш и пулы для всех магазинов.
+    Эндпоинты, которые есть только у одного магазина (parsing-items), добавляются в .app модуля магазина
+    с зависимостями .get_current_user и пулом .pool.
+    """
+    def __init__(self, spec: StoreSpec):
+        self.spec = spec
+        self.app = APIRouter()
+        self.security = HTTPBearer()
+        self.crawls = spec.crawls
+        self.pool = bulkhead(spec.prefix)
+        # краул и пользователь читаются из баз — в пуле магазина, а не в общем threadpool
+        self.crawl = self.pool(self.crawls)
+        self.basic = self.pool(verify_basic)
+        self.cached = response_cache.dependency(self.crawls, self.crawl)
+        self.reform_columns = {
+            schema: json_columns(schema) if spec.json_columns is True else tuple(spec.json_columns or ())
+            for schema in (spec.schema, spec.details_schema)
+        }
+
+        ensure_indexes(spec.product)
+        if spec.details is not None:
+            create_index(spec.details, [getattr(spec.details, spec.join)])
+            if not spec.lookup_scoped:
+                create_index(spec.details, [getattr(spec.details, spec.lookup)])
+        self.latest_view = LatestDetailsView(spec.product, spec.details, f'{spec.prefix}-latest.lock') if spec.materialized else None
+        self.columns = ColumnarStore(spec.product, spec.schema, spec.lookup, current=self.crawls.current) if spec.columnar else None
+
+        self.get_current_user = self.pool(self.user_dependency())
+        self.add_routes()
+
+    def user_dependency(self):
+        security = self.security
+
+        def get_current_user(request: Request, token: HTTPAuthorizationCredentials = Security(security)):
+            """
+            Проверка Bearer токена.
+
+            :param credentials: HTTPAuthorizationCredentials
+            :raises HTTPException: Если токен невалиден или отсутствует
+            """
+            user = user_by_token(token.credentials)
+            if user is None:
+                raise HTTPException(status_code=403, detail="Could not validate credentials")
+            rate_limiter.check_user(request, user)
+            return {"username": user.name, 'item': user.get_id()}
+        return get_current_user
+
+    def reformer(self, schema):
+        columns = self.reform_columns[schema]
+        if not columns:
+            return None
+
+        def reform(item):
+            for key in columns:
+                value = item.get(key)
+                if isinstance(value, str):
+                    try: item[key] = json.loads(value)
+                    except ValueError: pass
+            return item
+        return reform
+
+    def validate(self, rows, schema):
+        reform = self.reformer(schema)
+        if reform is None:
+            return [schema.model_validate(row) for row in rows]
+        return [schema.model_validate(reform(row)) for row in rows]
+
+    def scope(self, query, crawl):
+        """
+        Ограничивает выборку товаров краулом.
+        """
+        if hasattr(self.crawls, 'scope'):
+            return self.crawls.scope(query, crawl)
+        return query.where(self.spec.product.crawlid == crawl.crawlid)
+
+    def with_details(self, query, latest=False):
+        Product, Details = self.spec.product, self.spec.details
+        query = query.switch(Product).join(Details, on=(getattr(Product, self.spec.join) == getattr(Details, self.spec.join)))
+        if latest:
+            Latest = Details.alias()
+            query = query.where(Details.id == (
+                Latest
+                .select(fn.MAX(Latest.id))
+                .where(getattr(Latest, self.spec.join) == getattr(Details, self.spec.join))))
+        return query
+
+    def products(self, crawl):
+        """
+        Товары краула для списков, поиска и сводок: выборка, её модели и схема ответа.
+        """
+        Product, Details = self.spec.product, self.spec.details
+        if self.spec.details_in_lists:
+            query = self.with_details(self.scope(Product.select(Product, Details), crawl))
+            return query, [Product, Details], self.spec.details_schema
+        return self.scope(Product.select(), crawl), [Product], self.spec.schema
+
+    def details(self, crawl, keys=None):
+        """
+        Товары с деталями для выборки по id/url (keys) или для выгрузки всего краула (keys=None).
+        """
+        spec = self.spec
+        Product, Details = spec.product, spec.details
+        if Details is None:
+            query = self.scope(Product.select(), crawl)
+            if keys is not None:
+                query = query.where(getattr(Product, spec.lookup).in_(keys))
+            return query, [Product], spec.schema
+
+        if self.latest_view is not None and self.latest_view.ready(crawl):
+            View = self.latest_view.model
+            if keys is None:
+                return self.latest_view.select(crawl), [View, Details], spec.details_schema
+            query = self.latest_view.select().where(getattr(View, spec.lookup).in_(keys))
+            return query, [View, Details], spec.details_schema
+
+        if not spec.lookup_scoped and keys is not None:
+            key = getattr(Details, spec.lookup)
+            latest = Details.select(fn.MAX(Details.id)).where(key.in_(keys)).group_by(key)
+            return Details.select().where(Details.id.in_(latest)), [Details], spec.details_schema
+
+        columns = spec.export_columns if keys is None else spec.lookup_columns
+        selected = [Product] if columns is None else [getattr(Product, name) for name in columns]
+        query = self.with_details(self.scope(Product.select(*selected, Details), crawl), latest=spec.latest_details)
+        if keys is not None:
+            query = query.where(getattr(Product, spec.lookup).in_(keys))
+        return query, [Product, Details], spec.details_schema
+
+    def summary(self, crawl):
+        """
+        Сводка краула. Пока она считается в фоне — 503 с Retry-After.
+        """
+        query, models, _ = self.products(crawl)
+        summary = get_summary(self.spec.prefix, crawl, query, models)
+        if summary is None:
+            raise HTTPException(status_code=503, detail="Summary is being computed, retry later", headers={'Retry-After': '5'})
+        return summary
+
+    def total(self, crawl) -> int:
+        """
+        Число товаров краула: из сводки, а пока её нет — COUNT.
+        """
+        query, models, _ = self.products(crawl)
+        summary = get_summary(self.spec.prefix, crawl, query, models)
+        return summary.total if summary is not None else query.count()
+
+    def add_routes(self):
+        spec, app, pool = self.spec, self.app, self.pool
+        get_current_user, crawls, cached = self.get_current_user, self.crawl, self.cached
+        columns = self.columns
+
+        @app.get("/products/", response_model=List[self.products_schema])
+        @pool
+        def get_products(response: Response, offset: int = 0, limit: int = 10, filters: ProductFilter = Depends(filter_params), projection: Projection = Depends(projection_params), user: dict = Depends(get_current_user), latest_finished_crawl=Depends(crawls), cache=Depends(cached), packed: bool = Depends(msgpack_param)):
+            if latest_finished_crawl:
+                if not filters.active:
+                    response.headers['X-Total-Count'] = str(self.total(latest_finished_crawl))
+                snapshot = columns.get(latest_finished_crawl) if columns is not None else None
+                if snapshot is not None and not projection:
+                    return snapshot.response(snapshot.page(filters, offset, limit), response.headers, packed)
+                products, models, schema = self.products(latest_finished_crawl)
+                products = filters.apply(products.offset(offset).limit(limit), models)
+                not_found = "No products found." if spec.empty_not_found else None
+                if projection:
+                    return projection.response(products, models, schema, self.reformer(schema), not_found, packed, response.headers)
+                rows = list(products.dicts())
+                if not rows and not_found:
+                    raise HTTPException(status_code=404, detail=not_found)
+                if packed:
+                    return pack(rows, schema, self.reformer(schema), response.headers)
+                return self.validate(rows, schema)
+
+            raise HTTPException(status_code=404, detail="No products found.")
+
+        @app.get("/products/search/", response_model=List[self.products_schema])
+        @pool
+        def search_products(query: str, limit: Optional[int] = spec.search_limit, filters: ProductFilter = Depends(filter_params), projection: Projection = Depends(projection_params), user: dict = Depends(get_current_user), latest_finished_crawl=Depends(crawls), cache=Depends(cached), packed: bool = Depends(msgpack_param)):
+            if latest_finished_crawl:
+                products, models, schema = self.products(latest_finished_crawl)
+                products = products.where(spec.product.name.contains(query)).limit(limit)
+                if spec.distinct:
+                    products = products.group_by(getattr(spec.product, spec.distinct))
+                products = filters.apply(products, models)
+                not_found = "No products found for the given query." if spec.empty_not_found else None
+                if projection:
+                    return projection.response(products, models, schema, self.reformer(schema), not_found, packed)
+                rows = list(products.dicts())
+                if not rows and not_found:
+                    raise HTTPException(status_code=404, detail=not_found)
+                if packed:
+                    return pack(rows, schema, self.reformer(schema))
+                return self.validate(rows, schema)
+
+            raise HTTPException(status_code=404, detail="No products found for the given query.")
+
+        def lookup(keys, projection, crawl, not_found, packed=False):
+            if crawl is None and spec.lookup_scoped:
+                raise HTTPException(status_code=404, detail=not_found)
+            snapshot = columns.get(crawl) if columns is not None else None
+            if snapshot is not None and not projection:
+                rows = snapshot.by_ids(keys)
+                if not rows:
+                    raise HTTPException(status_code=404, detail=not_found)
+                return snapshot.response(rows, packed=packed)
+            products, models, schema = self.details(crawl, keys)
+            if projection:
+                return projection.response(products, models, schema, self.reformer(schema), not_found=not_found, packed=packed)
+            rows = list(products.dicts())
+            if not rows:
+                raise HTTPException(status_code=404, detail=not_found)
+            if packed:
+                return pack(rows, schema, self.reformer(schema))
+            return self.validate(rows, schema)
+
+        if spec.lookup == 'productUrl':
+            @app.get("/products/by_url/", response_model=List[self.lookup_schema])
+            @pool
+            def get_products_by_url(product_urls: List[str] = Query(...), projection: Projection = Depends(projection_params), user: dict = Depends(get_current_user), latest_finished_crawl=Depends(crawls), cache=Depends(cached), packed: bool = Depends(msgpack_param)):
+                return lookup(product_urls, projection, latest_finished_crawl, "No products found for the given URLS", packed)
+        else:
+            @app.get("/products/by_ids/", response_model=List[self.lookup_schema])
+            @pool
+            def get_products_by_ids(product_ids: List[str] = Query(...), projection: Projection = Depends(projection_params), user: dict = Depends(get_current_user), latest_finished_crawl=Depends(crawls), cache=Depends(cached), packed: bool = Depends(msgpack_param)):
+                return lookup(product_ids, projection, latest_finished_crawl, "No products found for the given IDs", packed)
+
+        @app.get("/products/stats")
+        @pool
+        def get_products_stats(user: dict = Depends(get_current_user), latest_finished_crawl=Depends(crawls), packed: bool = Depends(msgpack_param)):
+            if latest_finished_crawl:
+                stats = summary_stats(self.summary(latest_finished_crawl))
+                return MsgpackResponse(stats) if packed else stats
+
+            raise HTTPException(status_code=404, detail="No products found.")
+
+        @app.get("/products/facets")
+        @pool
+        def get_products_facets(user: dict = Depends(get_current_user), latest_finished_crawl=Depends(crawls), packed: bool = Depends(msgpack_param)):
+            if latest_finished_crawl:
+                facets = summary_facets(self.summary(latest_finished_crawl))
+                return MsgpackResponse(facets) if packed else facets
+
+            raise HTTPException(status_code=404, detail="No products found.")
+
+        if not spec.export:
+            return
+
+        export_keys = self.export_keys()
+
+        def get_export(format, query, keys, filters, projection, crawl):
+            if crawl:
+                content = self.export(crawl, format, query, keys, filters, projection)
+                if content is not None:
+                    return Response(
+                        content=content,
+                        media_type=FORMATS[format].media_type,
+                        headers={"Content-Disposition": f"attachment; filename=output.{format}"}
+                    )
+
+            raise HTTPException(status_code=404, detail="No products found")
+
+        @app.get("/products/output.xlsx")
+        @exports
+        def get_excel(query: Optional[str] = None, keys: Optional[List[str]] = Depends(export_keys), filters: ProductFilter = Depends(filter_params), projection: Projection = Depends(projection_params), credentials: HTTPBasicCredentials = Depends(self.basic), latest_finished_crawl=Depends(crawls), cache=Depends(cached)):
+            return get_export('xlsx', query, keys, filters, projection, latest_finished_crawl)
+
+        @app.get("/products/output.csv")
+        @exports
+        def get_csv(query: Optional[str] = None, keys: Optional[List[str]] = Depends(export_keys), filters: ProductFilter = Depends(filter_params), projection: Projection = Depends(projection_params), credentials: HTTPBasicCredentials = Depends(self.basic), latest_finished_crawl=Depends(crawls), cache=Depends(cached)):
+            return get_export('csv', query, keys, filters, projection, latest_finished_crawl)
+
+    def export_keys(self):
+        """
+        Зависимость со списком id или url для выгрузки — тот же параметр, что у выборки по id/url магазина.
+        """
+        if self.spec.lookup == 'productUrl':
+            async def keys(product_urls: Optional[List[str]] = Query(None)):
+                return product_urls
+        else:
+            async def keys(product_ids: Optional[List[str]] = Query(None)):
+                return product_ids
+        return keys
+
+    @property
+    def products_schema(self):
+        return self.spec.details_schema if self.spec.details_in_lists else self.spec.schema
+
+    @property
+    def lookup_schema(self):
+        return self.spec.details_schema if self.spec.details is not None else self.spec.schema
+
+    def export_query(self, crawl, filters: Optional[ProductFilter] = None, query: Optional[str] = None, keys: Optional[List[str]] = None, projection: Optional[Projection] = None):
+        """
+        Выборка товаров с деталями для выгрузки краула, её модели и схема.
+        Все условия и список колонок уходят в SQL: читаются только нужные строки и поля.
+
+        :param filters: фильтры и сортировка, как у /products/
+        :param query: подстрока названия, как у /products/search/
+        :param keys: id или url товаров, как у выборки по id/url
+        :param projection: колонки, как fields= у JSON-эндпоинтов
+        """
+        products, models, schema = self.details(crawl, keys or None)
+        if query:
+            products = products.where(find_field(models, ('name',)).contains(query))
+        if filters is not None:
+            products = filters.apply(products, models)
+        if projection:
+            products = products.select(*projection.columns(models, schema))
+        return products, models, schema
+
+    def rows(self, crawl, products, schema, fields: Optional[List[str]] = None, flat=True):
+        """
+        Строки выгрузки: первой — заголовок. Товары читаются курсором, не собираясь целиком в память.
+
+        :param fields: колонки выборки с projection; строки тогда не проходят через схему
+        :param flat: словари и списки — текстом для ячеек (flatten); False — как есть, для NDJSON
+        """
+        reform = self.reformer(schema) or (lambda item: item)
+        updated = [str(crawl.created_at)] if self.spec.export_updated else []
+        header = None
+        for product in products.dicts().iterator():
+            if fields:
+                row = reform(product)
+                row = {name: row.get(name) for name in fields}
+            else:
+                row = schema.model_validate(reform(product)).model_dump()
+            if header is None:
+                header = list(row.keys()) + (['Дата обновление'] if updated else [])
+                yield header
+            values = row.values()
+            yield [flatten(v) for v in values] + updated if flat else list(values) + updated
+
+    def export(self, crawl, format='xlsx', query=None, keys=None, filters=None, projection=None) -> Optional[bytes]:
+        """
+        Выгрузка краула в xlsx или csv. None — если подходящих товаров нет.
+        """
+        products, _, schema = self.export_query(crawl, filters, query, keys, projection)
+        file_stream = BytesIO()
+        write = xlsx.write if format == 'xlsx' else write_csv
+        if not write(self.rows(crawl, products, schema, projection.names if projection else None), file_stream):
+            return None
+        return file_stream.getvalue()
@@ -0,0 +1,13 @@
+import argparse
+import os
+import uvicorn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API парсеров в нескольких воркерах; бот работает в одном из них")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    uvicorn.run('main:app', host=args.host, port=args.port, workers=args.workers)
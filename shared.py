@@ -0,0 +1,124 @@
+import json
+import time
+from peewee import SqliteDatabase, Model, CharField, BlobField, IntegerField, FloatField, OperationalError, fn, chunked
+
+
+class SharedCache:
+    """
+    Кеш на локальном диске, общий для всех воркеров uvicorn: отдельная база SQLite в режиме WAL,
+    читатели не блокируют писателя, а страницы читаются через mmap.
+    Записи живут не дольше ttl, общий объём ограничен max_bytes — вытесняются давно не читанные.
+    Запись можно пометить краулом и сбросить вместе со всеми записями этого краула.
+    """
+    def __init__(self, path='cache.db', max_bytes=256 * 1024 * 1024, default_ttl=24 * 60 * 60, prune_interval=30):
+        """
+        :param path: файл базы кеша
+        :param max_bytes: предельный объём значений
+        :param default_ttl: время жизни записи по умолчанию, секунды
+        :param prune_interval: как часто процесс чистит просроченные и лишние записи, секунды
+        """
+        self.database = SqliteDatabase(path, timeout=5, check_same_thread=False, pragmas={
+            'journal_mode': 'wal',
+            'synchronous': 'normal',
+            'mmap_size': max_bytes,
+        })
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.prune_interval = prune_interval
+        self.touch_interval = 60
+        self._pruned = 0
+
+        class CacheEntry(Model):
+            key = CharField(primary_key=True)
+            crawl = CharField(null=True, index=True)
+            value = BlobField()
+            size = IntegerField()
+            expires_at = FloatField(index=True)
+            accessed_at = FloatField(index=True)
+
+            class Meta:
+                database = self.database
+                table_name = 'cache_entry'
+
+        self.model = CacheEntry
+        self.database.create_tables([CacheEntry])
+
+    def get(self, key):
+        Entry = self.model
+        now = time.time()
+        row = (
+            Entry
+            .select(Entry.value, Entry.accessed_at)
+            .where((Entry.key == key) & (Entry.expires_at > now))
+            .tuples()
+            .first()
+        )
+        if row is None:
+            return None
+        value, accessed_at = row
+        if now - accessed_at > self.touch_interval:
+            try:
+                Entry.update(accessed_at=now).where(Entry.key == key).execute()
+            except OperationalError:
+                pass
+        return bytes(value)
+
+    def set(self, key, value: bytes, ttl=None, crawl=None):
+        """
+        :param ttl: время жизни, секунды; по умолчанию default_ttl
+        :param crawl: метка краула для invalidate
+        """
+        Entry = self.model
+        now = time.time()
+        try:
+            Entry.insert(
+                key=key,
+                crawl=crawl,
+                value=value,
+                size=len(value),
+                expires_at=now + (ttl or self.default_ttl),
+                accessed_at=now,
+            ).on_conflict_replace().execute()
+        except OperationalError:
+            return
+        if now - self._pruned > self.prune_interval:
+            self._pruned = now
+            self.prune()
+
+    def get_json(self, key):
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key, value, ttl=None, crawl=None):
+        self.set(key, json.dumps(value).encode(), ttl=ttl, crawl=crawl)
+
+    def invalidate(self, crawl):
+        Entry = self.model
+        Entry.delete().where(Entry.crawl == crawl).execute()
+
+    def prune(self):
+        Entry = self.model
+        try:
+            with self.database.atomic('IMMEDIATE'):
+                Entry.delete().where(Entry.expires_at <= time.time()).execute()
+                excess = (Entry.select(fn.SUM(Entry.size)).scalar() or 0) - self.max_bytes
+                if excess <= 0:
+                    return
+                keys = []
+                for key, size in Entry.select(Entry.key, Entry.size).order_by(Entry.accessed_at).tuples():
+                    keys.append(key)
+                    excess -= size
+                    if excess <= 0:
+                        break
+                for batch in chunked(keys, 500):
+                    Entry.delete().where(Entry.key.in_(batch)).execute()
+        except OperationalError:
+            pass
+
+    def stats(self):
+        Entry = self.model
+        entries, size = Entry.select(fn.COUNT(Entry.key), fn.SUM(Entry.size)).tuples().first()
+        return {'entries': entries, 'bytes': size or 0}
+
+
+shared_cache = SharedCache()
@@ -0,0 +1,144 @@
+import fcntl
+import logging
+import re
+import time
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+from peewee import Model, AutoField, IntegerField, DateTimeField, BooleanField, CompositeKey, chunked, fn
+from crawls import CrawlCatalog
+from shared import shared_cache
+
+
+# повтор сборки снимка, секунды: пока его собирает другой процесс и после ошибки
+RETRY_BUSY = 5
+RETRY_FAILED = 60
+
+
+def snapshot_models(database):
+    """
+    Таблицы снимков в базе парсера: api_snapshot играет роль Crawl,
+    api_snapshot_item хранит id актуальной строки каждого товара в снимке.
+    """
+    class Snapshot(Model):
+        crawlid = AutoField()
+        watermark = IntegerField()
+        created_at = DateTimeField(default=datetime.now)
+        finished = BooleanField(default=True)
+
+        class Meta:
+            table_name = 'api_snapshot'
+
+    class SnapshotItem(Model):
+        snapshot = IntegerField()
+        product = IntegerField()
+
+        class Meta:
+            table_name = 'api_snapshot_item'
+            primary_key = CompositeKey('snapshot', 'product')
+            without_rowid = True
+
+    Snapshot.bind(database)
+    SnapshotItem.bind(database)
+    database.create_tables([Snapshot, SnapshotItem])
+    return Snapshot, SnapshotItem
+
+
+class SnapshotCatalog(CrawlCatalog):
+    """
+    Каталог снимков для парсеров без краулов (Ozon, Store77): товары дописываются в одну таблицу,
+    снимок фиксирует последнюю строку каждого товара на момент сборки.
+    Новый снимок собирается, когда таблица товаров не менялась quiet времени, — в фоне и только
+    в одном процессе (под flock); зависимость краула отдаёт последний уже собранный снимок.
+    """
+    def __init__(self, product, key='productId', quiet=timedelta(minutes=10), keep=3):
+        """
+        :param product: модель товара парсера
+        :param key: поле, по которому строки считаются одним товаром
+        :param quiet: сколько таблица должна не меняться, чтобы собрать снимок
+        :param keep: сколько последних снимков хранить
+        """
+        self.product = product
+        self.key = product._meta.fields[key]
+        self.keep = keep
+        self.Snapshot, self.Item = snapshot_models(product._meta.database)
+        self._lock = Lock()
+        self._pending = None
+        self._pending_since = 0
+        self.quiet = quiet
+        self._building = False
+        self._retry = 0
+        super().__init__(self.Snapshot)
+        self.lock_path = re.sub(r'[^\w.-]', '_', self.name) + '.lock'
+
+    def scope(self, query, crawl):
+        """
+        Ограничивает выборку товаров строками снимка.
+        """
+        return (
+            query
+            .join(self.Item, on=(self.Item.product == self.product._meta.primary_key))
+            .where(self.Item.snapshot == crawl.crawlid)
+        )
+
+    def refresh(self):
+        """
+        Запускает в фоне сборку нового снимка, если в таблице товаров появились и устоялись новые строки.
+        Первый снимок собирается сразу. Запрос сборку не ждёт.
+        """
+        pk = self.product._meta.primary_key
+        top = self.product.select(fn.MAX(pk)).scalar()
+        if top is None:
+            return
+        current = self.Snapshot.select().order_by(self.Snapshot.crawlid.desc()).first()
+        if current is not None:
+            if current.watermark >= top:
+                return
+            now = time.monotonic()
+            if self._pending != top:
+                self._pending, self._pending_since = top, now
+                return
+            if now - self._pending_since < self.quiet.total_seconds():
+                return
+        with self._lock:
+            if self._building or self._retry > time.monotonic():
+                return
+            self._building = True
+        Thread(target=self.update, args=(top,), daemon=True).start()
+
+    def update(self, top):
+        try:
+            with open(self.lock_path, 'w') as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self._retry = time.monotonic() + RETRY_BUSY
+                    return
+                self.build(top)
+        except Exception:
+            self._retry = time.monotonic() + RETRY_FAILED
+            logging.exception('Snapshot of %s failed', self.name)
+        finally:
+            with self._lock:
+                self._building = False
+
+    def build(self, top):
+        pk = self.product._meta.primary_key
+        # строки до top парсер уже не меняет: последние строки товаров читаются без блокировки записи,
+        # а под ней только пишутся
+        products = [row[0] for row in self.product.select(fn.MAX(pk)).where(pk <= top).group_by(self.key).tuples()]
+        with self.model._meta.database.atomic('IMMEDIATE'):
+            current = self.Snapshot.select().order_by(self.Snapshot.crawlid.desc()).first()
+            if current is not None and current.watermark >= top:
+                return current
+            snapshot = self.Snapshot.create(watermark=top)
+            for batch in chunked(products, 500):
+                self.Item.insert_many([(snapshot.crawlid, product) for product in batch], [self.Item.snapshot, self.Item.product]).execute()
+
+            old = [s.crawlid for s in self.Snapshot.select(self.Snapshot.crawlid).order_by(self.Snapshot.crawlid.desc()).offset(self.keep)]
+            if old:
+                self.Item.delete().where(self.Item.snapshot.in_(old)).execute()
+                self.Snapshot.delete().where(self.Snapshot.crawlid.in_(old)).execute()
+        for crawlid in old:
+            shared_cache.invalidate(f'{self.name}:{crawlid}')
+        return snapshot
+
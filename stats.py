@@ -0,0 +1,183 @@
+import fcntl
+import json
+import logging
+import time
+from threading import Lock, Thread
+import numpy as np
+from peewee import SQL, Case, fn
+from database import db, CrawlSummary
+
+
+PRICE_FIELDS = ('price',)
+BRAND_FIELDS = ('brandName', 'brand')
+CATEGORY_FIELDS = ('category', 'categoryName', 'category_name')
+STOCK_FIELDS = ('inStock', 'in_stock', 'available', 'stock', 'quantity')
+NO_STOCK = ('', '0', 'нет', 'no', 'false', 'none', 'отсутствует')
+
+# повтор подсчёта сводки, секунды: пока её считает другой процесс и после ошибки
+RETRY_BUSY = 5
+RETRY_FAILED = 60
+
+db.create_tables([CrawlSummary])
+_lock = Lock()
+_building = set()
+_retry = {}
+
+
+def find_field(models, names):
+    """
+    Возвращает первое найденное поле модели из списка имён.
+
+    :param models: модели, в которых ищется поле (в порядке приоритета)
+    :param names: возможные имена поля
+    """
+    for name in names:
+        for model in models:
+            field = model._meta.fields.get(name)
+            if field is not None:
+                return field
+
+
+def to_float(value):
+    try:
+        return float(str(value).replace(' ', '').replace(',', '.'))
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def number(field):
+    """
+    Значение поля как число в SQL, как to_float: без пробелов, запятая — десятичный разделитель.
+    """
+    text = fn.REPLACE(fn.REPLACE(fn.TRIM(field), ' ', ''), ',', '.')
+    # нечисловой текст — NULL, как NaN у to_float, а не 0, как у CAST
+    numeric = (fn.GLOB('*[0-9]*', text) == 1) & (fn.GLOB('*[^0-9.eE+-]*', text) == 0)
+    return Case(None, [(numeric, text.cast('REAL'))])
+
+
+def tally(query, field):
+    """
+    Число товаров по значениям поля, от частых к редким, при равенстве — по значению.
+    """
+    label, count = field.cast('TEXT'), fn.COUNT(SQL('*'))
+    rows = (
+        query
+        .select(label, count)
+        .where(field.is_null(False) & (label != ''))
+        .group_by(label)
+        .order_by(count.desc(), label)
+        .tuples()
+    )
+    return {str(value): int(total) for value, total in rows}
+
+
+def quantiles(query, value, count, qs):
+    """
+    Квантили, как np.quantile с линейной интерполяцией: по две соседние строки на квантиль,
+    без выборки всех цен.
+    """
+    result = []
+    for q in qs:
+        position = q * (count - 1)
+        pair = [row[0] for row in query.select(value).where(value.is_null(False)).order_by(value).limit(2).offset(int(position)).tuples()]
+        low, high = pair[0], pair[-1]
+        result.append(low + (high - low) * (position - int(position)))
+    return result
+
+
+def summarize(store, crawl, query, models):
+    """
+    Считает агрегаты краула в SQL и сохраняет их в CrawlSummary.
+
+    :param store: префикс магазина
+    :param crawl: законченный краул
+    :param query: выборка товаров краула
+    :param models: модели выборки, в которых ищутся поля цены, бренда, категории и наличия
+    """
+    # filters импортирует этот модуль
+    from filters import stock_condition
+
+    price = find_field(models, PRICE_FIELDS)
+    brand = find_field(models, BRAND_FIELDS)
+    category = find_field(models, CATEGORY_FIELDS)
+    stock = find_field(models, STOCK_FIELDS)
+
+    summary = dict(store=store, crawlid=str(crawl.crawlid), total=query.count())
+    if price is not None:
+        value = number(price)
+        count, mean = query.select(fn.COUNT(value), fn.AVG(value)).tuples().get()
+        if count:
+            q = quantiles(query, value, count, [0, 0.25, 0.5, 0.75, 1])
+            summary.update(
+                price_min=q[0], price_q25=q[1], price_median=q[2],
+                price_q75=q[3], price_max=q[4], price_mean=float(mean))
+    if stock is not None:
+        summary['in_stock'] = query.where(stock_condition(stock, True)).count()
+    if brand is not None:
+        summary['brands'] = json.dumps(tally(query, brand), ensure_ascii=False)
+    if category is not None:
+        summary['categories'] = json.dumps(tally(query, category), ensure_ascii=False)
+
+    # сводку мог уже записать другой воркер — тогда берём его строку
+    CrawlSummary.insert(**summary).on_conflict_ignore().execute()
+    return CrawlSummary.get(store=store, crawlid=summary['crawlid'])
+
+
+def build_summary(key, crawl, query, models, lock_path):
+    try:
+        with open(lock_path, 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # сводку считает другой процесс — не спрашиваем раньше, чем через RETRY_BUSY
+                _retry[key] = time.monotonic() + RETRY_BUSY
+                return
+            if CrawlSummary.get_or_none(store=key[0], crawlid=key[1]) is None:
+                summarize(key[0], crawl, query, models)
+    except Exception:
+        _retry[key] = time.monotonic() + RETRY_FAILED
+        logging.exception('Summary of %s for crawl %s failed', *key)
+    finally:
+        with _lock:
+            _building.discard(key)
+
+
+def get_summary(store, crawl, query, models):
+    """
+    Агрегаты краула из CrawlSummary или None, пока их нет. Первый запрос по новому краулу
+    запускает подсчёт в фоне — в одном процессе из всех воркеров (под flock).
+    """
+    summary = CrawlSummary.get_or_none(store=store, crawlid=str(crawl.crawlid))
+    if summary is None:
+        key = (store, str(crawl.crawlid))
+        with _lock:
+            if key not in _building and _retry.get(key, 0) <= time.monotonic():
+                _building.add(key)
+                Thread(target=build_summary, args=(key, crawl, query, models, f'summary-{store}.lock'), daemon=True).start()
+    return summary
+
+
+def summary_stats(summary: CrawlSummary):
+    return {
+        'crawlid': summary.crawlid,
+        'total': summary.total,
+        'in_stock': summary.in_stock,
+        'price': {
+            'min': summary.price_min,
+            'q25': summary.price_q25,
+            'median': summary.price_median,
+            'q75': summary.price_q75,
+            'max': summary.price_max,
+            'mean': summary.price_mean,
+        },
+        'brands': len(json.loads(summary.brands)),
+        'categories': len(json.loads(summary.categories)),
+    }
+
+
+def summary_facets(summary: CrawlSummary):
+    return {
+        'crawlid': summary.crawlid,
+        'brands': json.loads(summary.brands),
+        'categories': json.loads(summary.categories),
+    }
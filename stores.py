@@ -0,0 +1,112 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from threading import Lock
+from anyio import to_thread
+from fastapi import FastAPI
+from cache import CacheHit, cache_hit
+
+
+class Store:
+    """
+    Магазин в реестре: префикс URL, модуль роутера и тег документации.
+    """
+    def __init__(self, prefix, module, tag):
+        self.prefix = prefix
+        self.module = module
+        self.tag = tag
+
+
+STORES = [
+    Store('ozon', 'ozon', 'Ozon'),
+    Store('citilink', 'citilink', 'Citilink'),
+    Store('wb', 'wildberries', 'Wildberries'),
+    Store('mvideo', 'mvideo', 'MVideo'),
+    Store('norbel', 'norbel', 'Norbel'),
+    Store('resurs-media', 'resurs_media', 'Resurs-Media'),
+    Store('absolut-trade', 'absolut_trade', 'Elko'),
+    Store('pronet', 'pronet', 'ProNet'),
+    Store('f5it', 'f5it', 'F5IT'),
+    Store('logic', 'logic', '3Logic'),
+    Store('vvp', 'vvp', 'VVP'),
+    Store('store77', 'store77', 'Store77'),
+]
+
+
+class LazyStore:
+    """
+    ASGI-приложение магазина, которое импортирует модуль роутера (а с ним модели и базу парсера)
+    при первом запросе. Документация магазина — на /<prefix>/docs.
+    """
+    def __init__(self, store: Store):
+        self.store = store
+        self.app = None
+        self._lock = Lock()
+
+    def load(self):
+        with self._lock:
+            if self.app is None:
+                module = importlib.import_module(self.store.module)
+                app = FastAPI(title=self.store.tag)
+                app.add_exception_handler(CacheHit, cache_hit)
+                app.include_router(module.app, tags=[self.store.tag])
+                self.app = app
+        return self.app
+
+    async def __call__(self, scope, receive, send):
+        app = self.app
+        if app is None:
+            app = await to_thread.run_sync(self.load)
+        await app(scope, receive, send)
+
+
+def mount_stores(app: FastAPI):
+    for store in STORES:
+        app.mount(f'/{store.prefix}', LazyStore(store), name=store.prefix)
+
+
+def measure(module):
+    """
+    Время импорта и прирост RSS модуля роутера в чистом процессе,
+    после общих для всех магазинов модулей приложения.
+    """
+    code = (
+        'import json, time, resource\n'
+        'import fastapi, peewee, numpy, cache, crawls, filters, projection, stats\n'
+        'rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n'
+        'started = time.perf_counter()\n'
+        f'import {module}\n'
+        'print(json.dumps({"seconds": time.perf_counter() - started,'
+        ' "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss}))\n'
+    )
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.path.dirname(os.path.abspath(__file__))] + sys.path))
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env)
+    if out.returncode != 0:
+        return {'error': out.stderr.strip().splitlines()[-1] if out.stderr.strip() else 'failed'}
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_report():
+    """
+    Сколько времени старта и памяти каждого воркера экономит ленивая загрузка каждого магазина.
+    """
+    total_seconds = total_rss = 0
+    print(f'{"store":<15}{"import, ms":>12}{"RSS, MB":>10}')
+    for store in STORES:
+        result = measure(store.module)
+        if 'error' in result:
+            print(f'{store.prefix:<15}  {result["error"]}')
+            continue
+        total_seconds += result['seconds']
+        total_rss += result['rss_kb']
+        print(f'{store.prefix:<15}{result["seconds"] * 1000:>12.0f}{result["rss_kb"] / 1024:>10.1f}')
+    print(f'{"total":<15}{total_seconds * 1000:>12.0f}{total_rss / 1024:>10.1f}')
+
+
+if __name__ == "__main__":
+    started = time.perf_counter()
+    import_report()
+    print(f'measured in {time.perf_counter() - started:.1f} s')
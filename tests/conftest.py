@@ -0,0 +1,123 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import uuid4
+
+import pytest
+from pydantic import BaseModel, ConfigDict
+
+# модули приложения создают базы и файлы в текущем каталоге при импорте
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix='parser-api-tests-'))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from peewee import SqliteDatabase, Model, CharField, FloatField, BooleanField, DateTimeField
+
+import exports
+from admission import AdmissionControl
+from cache import CacheHit, cache_hit, cache_responses
+from crawls import CrawlCatalog, crawl_headers
+from database import User, db as data_db
+from ratelimit import rate_limit_headers
+from routers import StoreSpec, StoreRouter
+
+
+shop_db = SqliteDatabase('shop.db', pragmas={'journal_mode': 'wal'}, check_same_thread=False)
+
+
+class ShopModel(Model):
+    class Meta:
+        database = shop_db
+
+
+class Crawl(ShopModel):
+    crawlid = CharField(unique=True)
+    created_at = DateTimeField(default=datetime.now)
+    finished = BooleanField(default=False)
+
+
+class Product(ShopModel):
+    productId = CharField()
+    productUrl = CharField()
+    name = CharField(null=True)
+    price = FloatField(null=True)
+    brandName = CharField(null=True)
+    inStock = BooleanField(default=True)
+    crawlid = CharField(null=True)
+
+
+class ProductSchema(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    productId: str
+    productUrl: Optional[str] = None
+    name: Optional[str] = None
+    price: Optional[float] = None
+    brandName: Optional[str] = None
+    inStock: Optional[bool] = None
+
+
+BRANDS = ['Acer', 'Asus', None, 'Lenovo']
+NOW = datetime.now()
+CRAWLS = {
+    'old': (NOW - timedelta(days=2), True),
+    'new': (NOW - timedelta(days=1), True),
+    'running': (NOW - timedelta(hours=1), False),
+}
+
+
+def seed():
+    shop_db.create_tables([Crawl, Product])
+    data_db.create_tables([User])
+    for crawlid, (created_at, finished) in CRAWLS.items():
+        Crawl.create(crawlid=crawlid, created_at=created_at, finished=finished)
+        rows = []
+        for i in range(60):
+            # повторяющиеся цены и названия, пустые цены, бренды и названия
+            rows.append({
+                'productId': f'{crawlid}-{i:03d}',
+                'productUrl': f'https://shop.test/{crawlid}/{i}',
+                'name': None if i % 17 == 0 else f'Item {i % 7}',
+                'price': None if i % 11 == 0 else float((i * 37) % 23),
+                'brandName': BRANDS[i % len(BRANDS)],
+                'inStock': i % 3 != 0,
+                'crawlid': crawlid,
+            })
+        Product.insert_many(rows).execute()
+
+
+seed()
+shop = StoreRouter(StoreSpec('shop', Product, ProductSchema, CrawlCatalog(Crawl), columnar=True))
+
+
+def make_app(admission=None):
+    app = FastAPI()
+    app.middleware('http')(cache_responses)
+    app.middleware('http')(crawl_headers)
+    app.middleware('http')(rate_limit_headers)
+    app.middleware('http')(admission or AdmissionControl())
+    app.add_exception_handler(CacheHit, cache_hit)
+    app.include_router(shop.app, prefix='/shop')
+    app.include_router(exports.app, prefix='/exports')
+    return app
+
+
+@pytest.fixture(scope='session')
+def client():
+    return TestClient(make_app())
+
+
+@pytest.fixture
+def user():
+    """
+    Новый пользователь на тест: у каждого свои корзины RateLimiter.
+    """
+    return User.create(name=f'user-{uuid4().hex}')
+
+
+@pytest.fixture
+def auth(user):
+    return {'Authorization': f'Bearer {user.token}'}
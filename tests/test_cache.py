@@ -0,0 +1,68 @@
+from conftest import CRAWLS
+
+
+def test_etag_not_modified(client, auth):
+    first = client.get('/shop/products/', params={'limit': 5, 'sort': 'price'}, headers=auth)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['X-Crawl-Id'] == 'new'
+    assert 'Last-Modified' in first.headers
+
+    again = client.get('/shop/products/', params={'sort': 'price', 'limit': 5}, headers={**auth, 'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.headers['ETag'] == etag
+    assert again.content == b''
+
+    other = client.get('/shop/products/', params={'limit': 6, 'sort': 'price'}, headers={**auth, 'If-None-Match': etag})
+    assert other.status_code == 200
+    assert other.headers['ETag'] != etag
+
+
+def test_cached_response_is_the_same(client, auth):
+    params = {'brand': 'Acer', 'limit': 20}
+    first = client.get('/shop/products/', params=params, headers=auth)
+    second = client.get('/shop/products/', params=params, headers=auth)
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert first.headers['ETag'] == second.headers['ETag']
+    assert {item['brandName'] for item in first.json()} == {'Acer'}
+
+
+def test_etag_depends_on_crawl(client, auth):
+    latest = client.get('/shop/products/', params={'limit': 3}, headers=auth)
+    old = client.get('/shop/products/', params={'limit': 3, 'crawl': 'old'}, headers={**auth, 'If-None-Match': latest.headers['ETag']})
+    assert old.status_code == 200
+    assert old.headers['ETag'] != latest.headers['ETag']
+
+
+def test_latest_finished_crawl_by_default(client, auth):
+    response = client.get('/shop/products/', params={'limit': 3}, headers=auth)
+    assert response.headers['X-Crawl-Id'] == 'new'
+    assert all(item['productId'].startswith('new-') for item in response.json())
+    assert response.headers['X-Total-Count'] == '60'
+
+
+def test_crawl_by_id(client, auth):
+    response = client.get('/shop/products/', params={'limit': 3, 'crawl': 'old'}, headers=auth)
+    assert response.status_code == 200
+    assert response.headers['X-Crawl-Id'] == 'old'
+    assert all(item['productId'].startswith('old-') for item in response.json())
+
+
+def test_unfinished_crawl_not_found(client, auth):
+    response = client.get('/shop/products/', params={'crawl': 'running'}, headers=auth)
+    assert response.status_code == 404
+    response = client.get('/shop/products/', params={'crawl': 'missing'}, headers=auth)
+    assert response.status_code == 404
+
+
+def test_crawl_by_timestamp(client, auth):
+    old, new, running = (created_at for created_at, _ in CRAWLS.values())
+    between = old + (new - old) / 2
+    response = client.get('/shop/products/', params={'limit': 3, 'crawl': between.isoformat()}, headers=auth)
+    assert response.headers['X-Crawl-Id'] == 'old'
+    # незаконченный краул пропускается — последний законченный на этот момент
+    response = client.get('/shop/products/', params={'limit': 3, 'crawl': running.isoformat()}, headers=auth)
+    assert response.headers['X-Crawl-Id'] == 'new'
+    response = client.get('/shop/products/', params={'crawl': (old - (new - old)).isoformat()}, headers=auth)
+    assert response.status_code == 404
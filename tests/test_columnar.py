@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from columnar import ColumnarStore
+from filters import ProductFilter
+from conftest import Crawl, Product, ProductSchema, shop
+
+
+@pytest.fixture(scope='module')
+def snapshot(tmp_path_factory):
+    crawl = Crawl.get(Crawl.crawlid == 'new')
+    store = ColumnarStore(Product, ProductSchema, directory=str(tmp_path_factory.mktemp('catalog')))
+    store.build(crawl)
+    snapshot = store.get(crawl)
+    assert snapshot is not None
+    return crawl, snapshot
+
+
+def sql_page(crawl, filters, offset, limit):
+    products, models, schema = shop.products(crawl)
+    rows = filters.apply(products.offset(offset).limit(limit), models).dicts()
+    return [item.model_dump(mode='json') for item in shop.validate(rows, schema)]
+
+
+@pytest.mark.parametrize('params', [
+    {},
+    {'sort': 'price'},
+    {'sort': '-price'},
+    {'sort': 'name'},
+    {'price_min': 5, 'price_max': 15},
+    {'price_min': 5, 'sort': '-price'},
+    {'brand': 'Asus', 'sort': 'price'},
+    {'brand': 'Unknown'},
+    {'in_stock': True, 'sort': 'name'},
+    {'in_stock': False, 'brand': 'Lenovo'},
+])
+@pytest.mark.parametrize('offset, limit', [(0, 10), (7, 25), (50, 100)])
+def test_page_matches_sql(snapshot, params, offset, limit):
+    crawl, snapshot = snapshot
+    filters = ProductFilter(**{'price_min': None, 'price_max': None, 'brand': None, 'in_stock': None, 'sort': None, **params})
+    expected = sql_page(crawl, filters, offset, limit)
+    body = snapshot.response(snapshot.page(filters, offset, limit)).body
+    assert json.loads(body) == expected
+
+
+def test_by_ids_matches_sql(snapshot):
+    crawl, snapshot = snapshot
+    keys = ['new-003', 'new-044', 'new-010', 'missing', 'old-003']
+    products, _, schema = shop.details(crawl, keys)
+    expected = sorted((item.model_dump(mode='json') for item in shop.validate(products.dicts(), schema)), key=lambda item: item['productId'])
+    found = sorted(json.loads(snapshot.response(snapshot.by_ids(keys)).body), key=lambda item: item['productId'])
+    assert found == expected
+    assert [item['productId'] for item in found] == ['new-003', 'new-010', 'new-044']
@@ -0,0 +1,114 @@
+import csv
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit, parse_qsl
+
+import pytest
+
+import exports
+from downloads import signed_links
+from exports import ExportQueue
+from conftest import shop
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    """
+    Очередь в своём каталоге; диапазоны пишут потоки вместо процессов spawn,
+    которые не видят тестовый магазин.
+    """
+    queue = ExportQueue(processes=2, shard_rows=8, directory=str(tmp_path))
+    queue.pool = ThreadPoolExecutor(2)
+    monkeypatch.setattr(exports, 'export_queue', queue)
+    monkeypatch.setattr(exports, 'store_router', lambda prefix: shop)
+    yield queue
+    queue.pool.shutdown()
+
+
+def submit(client, auth, **body):
+    response = client.post('/exports', json={'store': 'shop', 'format': 'csv', **body}, headers=auth)
+    assert response.status_code == 202
+    return response.json()
+
+
+def download_url(url, **params):
+    parts = urlsplit(url)
+    query = {**dict(parse_qsl(parts.query)), **params}
+    return f'{parts.path}?{urlencode(query)}'
+
+
+def job_link(job):
+    expires = int(time.time()) + 60
+    path = f'/exports/{job["id"]}/download'
+    return f'{path}?expires={expires}&signature={signed_links.signature(path, expires)}'
+
+
+def test_lifecycle(client, auth, queue):
+    job = submit(client, auth, brand='Asus', sort='price')
+    assert job['status'] == 'pending'
+    assert job['crawl'] == 'new'
+    assert 'download' not in job
+    # та же выгрузка, пока задача ждёт, — та же задача
+    assert submit(client, auth, sort='price', brand='Asus')['id'] == job['id']
+
+    queue.build(job['id'])
+    status = client.get(f'/exports/{job["id"]}', headers=auth).json()
+    assert status['status'] == 'done'
+    assert status['progress'] == status['total'] == 15
+
+    response = client.get(download_url(status['download']))
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.content.decode('utf-8-sig'))))
+    expected = client.get('/shop/products/', params={'brand': 'Asus', 'sort': 'price', 'limit': 100}, headers=auth).json()
+    assert [row['productId'] for row in rows] == [item['productId'] for item in expected]
+
+    # собранная выгрузка с файлом на месте отдаётся повторно
+    assert submit(client, auth, brand='Asus', sort='price')['id'] == job['id']
+
+    queue.ttl = 0
+    queue.expire()
+    status = client.get(f'/exports/{job["id"]}', headers=auth).json()
+    assert status['status'] == 'expired'
+    assert 'download' not in status
+    assert client.get(job_link(job)).status_code == 404
+    assert submit(client, auth, brand='Asus', sort='price')['id'] != job['id']
+
+
+def test_failed_job(client, auth, queue):
+    job = submit(client, auth, price_min=1000)
+    queue.build(job['id'])
+    status = client.get(f'/exports/{job["id"]}', headers=auth).json()
+    assert status['status'] == 'failed'
+    assert status['error'] == 'No products found'
+    assert client.get(job_link(job)).status_code == 404
+
+
+def test_unknown_fields_rejected(client, auth, queue):
+    response = client.post('/exports', json={'store': 'shop', 'fields': 'productId,nope'}, headers=auth)
+    assert response.status_code == 400
+
+
+def test_status_requires_token(client, auth, queue):
+    job = submit(client, auth)
+    assert client.get(f'/exports/{job["id"]}').status_code in (401, 403)
+    assert client.get(f'/exports/{job["id"]}', headers={'Authorization': 'Bearer nope'}).status_code == 403
+
+
+def test_signed_download_rejected(client, auth, queue):
+    job = submit(client, auth, in_stock=True)
+    queue.build(job['id'])
+    url = client.get(f'/exports/{job["id"]}', headers=auth).json()['download']
+    assert client.get(download_url(url)).status_code == 200
+
+    path = urlsplit(url).path
+    assert client.get(path).status_code == 403
+    assert client.get(download_url(url, signature='0' * 64)).status_code == 403
+    # срок ссылки подписан — продлить её нельзя
+    assert client.get(download_url(url, expires=int(time.time()) + 2 * signed_links.ttl)).status_code == 403
+    expired = int(time.time()) - 1
+    assert client.get(f'{path}?expires={expired}&signature={signed_links.signature(path, expired)}').status_code == 403
+    # подпись одной задачи не подходит к другой
+    other = submit(client, auth, in_stock=False)
+    queue.build(other['id'])
+    assert client.get(download_url(url).replace(job['id'], other['id'])).status_code == 403
@@ -0,0 +1,108 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from admission import AdmissionControl, route_class
+from ratelimit import rate_limiter
+from conftest import User, make_app
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'defaults', {'cheap': 3, 'expensive': 1})
+
+
+def test_rate_limit_headers(client, auth, limits):
+    remaining = []
+    for limit in (3, 4, 5):
+        response = client.get('/shop/products/', params={'limit': limit}, headers=auth)
+        assert response.status_code == 200
+        assert response.headers['RateLimit-Limit'] == '3'
+        remaining.append(int(response.headers['RateLimit-Remaining']))
+        assert int(response.headers['RateLimit-Reset']) > 0
+    assert remaining == [2, 1, 0]
+
+    response = client.get('/shop/products/', params={'limit': 6}, headers=auth)
+    assert response.status_code == 429
+    assert response.headers['RateLimit-Remaining'] == '0'
+    assert int(response.headers['Retry-After']) > 0
+
+
+def test_cache_hits_are_limited(client, auth, limits):
+    for _ in range(3):
+        assert client.get('/shop/products/', params={'limit': 2}, headers=auth).status_code == 200
+    assert client.get('/shop/products/', params={'limit': 2}, headers=auth).status_code == 429
+
+
+def test_expensive_bucket(client, auth, limits):
+    # сводка собирается в фоне: пока её нет — 503, но запрос уже учтён
+    assert client.get('/shop/products/stats', headers=auth).status_code in (200, 503)
+    response = client.get('/shop/products/stats', headers=auth)
+    assert response.status_code == 429
+    assert response.headers['RateLimit-Limit'] == '1'
+    # дешёвые запросы считаются отдельно
+    assert client.get('/shop/products/', params={'limit': 1}, headers=auth).status_code == 200
+
+
+def test_user_limit(client, limits):
+    user = User.create(name='limited', rate_limit=1, expensive_rate_limit=5)
+    headers = {'Authorization': f'Bearer {user.token}'}
+    response = client.get('/shop/products/', params={'limit': 7}, headers=headers)
+    assert response.headers['RateLimit-Limit'] == '1'
+    assert client.get('/shop/products/', params={'limit': 7}, headers=headers).status_code == 429
+    assert client.get('/shop/products/stats', headers=headers).headers['RateLimit-Limit'] == '5'
+
+
+@pytest.mark.parametrize('path, kind', [
+    ('/shop/products/', 'interactive'),
+    ('/shop/products/by_ids/', 'interactive'),
+    ('/shop/products/output.xlsx', 'export'),
+    ('/exports', 'interactive'),
+    ('/exports/abc', 'interactive'),
+    ('/exports/abc/download', 'export'),
+    ('/exports/all.csv', 'export'),
+    ('/exports/all.parquet', 'export'),
+    ('/docs', None),
+    ('/metrics/cache', None),
+])
+def test_route_class(path, kind):
+    assert route_class(path) == kind
+
+
+def test_admission_rejects_interactive(auth):
+    admission = AdmissionControl(interactive=0)
+    client = TestClient(make_app(admission))
+    response = client.get('/shop/products/', headers=auth)
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+    assert admission.metrics()['interactive']['rejected'] == 1
+    # служебные пути не ограничиваются
+    assert client.get('/docs').status_code == 200
+
+
+def test_admission_rejects_exports(auth):
+    admission = AdmissionControl(export=0, retry_export=17)
+    client = TestClient(make_app(admission))
+    response = client.get('/exports/all.csv', auth=('user', 'password'))
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '17'
+    assert client.get('/shop/products/', params={'limit': 1}, headers=auth).status_code == 200
+
+
+def test_admission_sheds_exports_first():
+    admission = AdmissionControl(interactive=2, export=4, interactive_busy=1)
+    assert admission.admit('interactive')
+    assert not admission.admit('export')
+    assert admission.admit('interactive')
+    assert not admission.admit('interactive')
+    admission.release('interactive')
+    admission.release('interactive')
+    assert admission.admit('export')
+    assert admission.metrics()['export'] == {'limit': 4, 'in_flight': 1, 'admitted': 1, 'rejected': 1}
+
+
+def test_admission_releases_slots(auth):
+    admission = AdmissionControl(interactive=1)
+    client = TestClient(make_app(admission))
+    for limit in range(1, 4):
+        assert client.get('/shop/products/', params={'limit': limit}, headers=auth).status_code == 200
+    assert admission.in_flight == {'interactive': 0, 'export': 0}
@@ -1,16 +1,25 @@
-
-from fastapi import Depends, HTTPException
+import os
+import secrets
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
+from ratelimit import rate_limiter
 
 
 download_pass = HTTPBasic()
 
-def verify_basic(credentials: HTTPBasicCredentials = Depends(download_pass)):
-    correct_username = "kgzakup@yandex.ru"
-    correct_password = "Krainevgroup2024"
-    if credentials.username != correct_username or credentials.password != correct_password:
+def verify_basic(request: Request, credentials: HTTPBasicCredentials = Depends(download_pass)):
+    """
+    Basic-доступ к синхронным выгрузкам. Логин и пароль — из DOWNLOAD_USERNAME и DOWNLOAD_PASSWORD;
+    если они не заданы, доступ закрыт и файлы скачиваются по подписанным ссылкам /exports.
+    """
+    username = os.environ.get('DOWNLOAD_USERNAME', '')
+    password = os.environ.get('DOWNLOAD_PASSWORD', '')
+    valid = secrets.compare_digest(credentials.username.encode(), username.encode())
+    valid &= secrets.compare_digest(credentials.password.encode(), password.encode())
+    if not (username and password and valid):
         raise HTTPException(
             status_code=401,
             detail="Invalid credentials",
             headers={"WWW-Authenticate": "Basic"},
         )
+    rate_limiter.check(request, f'basic:{credentials.username}')
@@ -1,3 +1,4 @@
+from datetime import timedelta
 import sys
 import os
 
@@ -5,32 +6,27 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.append(parent_dir)
 
-from fastapi import APIRouter, HTTPException, Depends, Query, Request, Security
-from fastapi.security import  HTTPBearer, HTTPAuthorizationCredentials
+from fastapi import HTTPException, Depends, Request
 from typing import List
 from wb_parser.schemas import ParsingListCreate, ProductDetailsResponse, ProductResponse, ParsingItemCreate
 from wb_parser.wildberries.database import ParsingList, ProductResponseModel as Product, \
     ProductDetailsResponseModel as ProductDetails, ParsingItem, Crawl
 import requests
 from database import User
+from crawls import CrawlCatalog
+from routers import StoreSpec, StoreRouter
 
 
-app = APIRouter()
-security = HTTPBearer()
-
-
-# Dependency to get the current user
-def get_current_user(token: HTTPAuthorizationCredentials = Security(security)):
-    """
-    Проверка Bearer токена.
-    
-    :param credentials: HTTPAuthorizationCredentials
-    :raises HTTPException: Если токен невалиден или отсутствует
-    """
-    user = User.get_or_none(token=token.credentials)
-    if user is None:
-        raise HTTPException(status_code=403, detail="Could not validate credentials")
-    return {"username": user.name, 'item': user.get_id()}
+# краул WB считается законченным через 2 часа после начала, как у citilink
+crawls = CrawlCatalog(Crawl, settle=timedelta(hours=2))
+store = StoreRouter(StoreSpec(
+    'wb', Product, ProductResponse, crawls,
+    details=ProductDetails, details_schema=ProductDetailsResponse, join='productUrl',
+    lookup='productUrl', lookup_columns=('price',), export=False,
+))
+app = store.app
+pool = store.pool
+get_current_user = store.get_current_user
 
 
 @app.post("/create-user/", status_code=201)
@@ -40,6 +36,7 @@ async def create_user(request: Request, user: dict = Depends(get_current_user)):
     return {'success': True, 'user': new_user.token}
 
 @app.post("/parsing-item/", response_model=ParsingItemCreate, status_code=201)
+@pool
 def create_parsing_item(item: ParsingItemCreate, user: dict = Depends(get_current_user)):
     product_id = item.product_id
     if product_id.startswith('http'):
@@ -56,6 +53,7 @@ def create_parsing_item(item: ParsingItemCreate, user: dict = Depends(get_curren
     return ParsingItemCreate.model_validate(product_db)
 
 @app.post("/parsing-items/", response_model=ParsingListCreate, status_code=201)
+@pool
 def create_list(parsing_list: ParsingListCreate, user: dict = Depends(get_current_user)):
     list_db = ParsingList.get_or_none(
         page_url=parsing_list.link
@@ -82,6 +80,7 @@ def create_list(parsing_list: ParsingListCreate, user: dict = Depends(get_curren
     return ParsingListCreate.model_validate(list_db)
 
 @app.get("/parsing-item/", response_model=List[ParsingItemCreate], status_code=200)
+@pool
 def get_parsing_items(user: dict = Depends(get_current_user)):
     items = ParsingItem.select()
     if items:
@@ -90,6 +89,7 @@ def get_parsing_items(user: dict = Depends(get_current_user)):
     raise HTTPException(status_code=404, detail="No items found")
 
 @app.get("/parsing-items/", response_model=List[ParsingListCreate], status_code=200)
+@pool
 def get_parsing_lists(user: dict = Depends(get_current_user)):
     items = ParsingList.select()
     if items:
@@ -98,6 +98,7 @@ def get_parsing_lists(user: dict = Depends(get_current_user)):
     raise HTTPException(status_code=404, detail="No lists found")
 
 @app.delete("/parsing-item/", status_code=200)
+@pool
 def del_parsing_item(item: ParsingItemCreate, user: dict = Depends(get_current_user)):
     product_db = ParsingItem.get_or_none(
         link=item.link
@@ -111,6 +112,7 @@ def del_parsing_item(item: ParsingItemCreate, user: dict = Depends(get_current_u
     return {'seccess': True, 'message': 'Successfully deleted'}
 
 @app.delete("/parsing-items/", status_code=200)
+@pool
 def del_parsing_lists(item: ParsingListCreate, user: dict = Depends(get_current_user)):
     product_db = ParsingList.get_or_none(
         link=item.link
@@ -122,34 +124,3 @@ def del_parsing_lists(item: ParsingListCreate, user: dict = Depends(get_current_
             return {'success': False, 'message': 'You are not the author of this item.'}
 
     return {'seccess': True, 'message': 'Successfully deleted'}
-
-@app.get("/products/", response_model=List[ProductResponse])
-def get_products(offset: int = 0, limit: int = 10, user: dict = Depends(get_current_user)):
-    products = Product.select().offset(offset).limit(limit)
-    return [ProductResponse.model_validate(product) for product in products]
-
-@app.get("/products/search/", response_model=List[ProductResponse])
-def search_products(query: str, limit: int = 10, user: dict = Depends(get_current_user)):
-    products = Product.select().where(Product.name.contains(query)).limit(limit)
-    return [ProductResponse.model_validate(product) for product in products]
-
-@app.get("/products/by_url/", response_model=List[ProductDetailsResponse])
-def get_products_by_ids(product_urls: List[str] = Query(...), user: User = Depends(get_current_user)):
-    latest_finished_crawl: Crawl = (
-        Crawl
-        .select()
-        .order_by(Crawl.created_at.desc())
-        .first()
-    )
-
-    if latest_finished_crawl:
-        products = (
-            ProductDetails
-            .select(Product.price, ProductDetails)
-            .join(Product, on=(ProductDetails.productUrl == Product.productUrl))
-            .where((Product.productUrl.in_(product_urls)) & (Product.crawlid == latest_finished_crawl.crawlid))
-        )
-        if products:
-            return [ProductDetailsResponse.model_validate(product) for product in products.dicts()]
-
-    raise HTTPException(status_code=404, detail="No products found for the given IDs")
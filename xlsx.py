@@ -0,0 +1,356 @@
+import math
+import time
+import zipfile
+from datetime import date, datetime
+from itertools import chain, islice
+from xml.sax.saxutils import escape
+
+
+# управляющие символы недопустимы в XML — выбрасываются, &<> экранируются за один проход
+TEXT = str.maketrans({**{chr(c): None for c in range(32) if c not in (9, 10, 13)}, '&': '&amp;', '<': '&lt;', '>': '&gt;'})
+EPOCH = datetime(1899, 12, 30)
+SHARED_STRINGS = 65536
+SAMPLE = 1000
+
+CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '{sheets}'
+    '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+    '</Types>'
+)
+SHEET_TYPE = '<Override PartName="/xl/worksheets/sheet{n}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets>{sheets}</sheets>'
+    '</workbook>'
+)
+SHEET_ENTRY = '<sheet name="{title}" sheetId="{n}" r:id="rId{n}"/>'
+WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '{sheets}'
+    '<Relationship Id="rIdStyles" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '<Relationship Id="rIdStrings" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>'
+    '</Relationships>'
+)
+SHEET_REL = '<Relationship Id="rId{n}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{n}.xml"/>'
+# стили: 0 — обычная ячейка, 1 — заголовок, 2 — дата и время
+STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy\\-mm\\-dd\\ hh:mm:ss"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3">'
+    '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '</cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+SHEET_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+)
+SHEET_TAIL = '</sheetData></worksheet>'
+SST_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" uniqueCount="{count}">'
+)
+
+
+def text(value):
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{str(value).translate(TEXT)}</t></is></c>'
+
+
+def serial(value):
+    """
+    Дата в формате Excel: дни от 1899-12-30 с долей суток.
+    """
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return (value.replace(tzinfo=None) - EPOCH).total_seconds() / 86400
+
+
+def cell(value):
+    kind = type(value)
+    if kind is str:
+        return text(value)
+    if value is None:
+        return '<c/>'
+    if kind is bool:
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if kind is int or (kind is float and math.isfinite(value)):
+        return f'<c><v>{value!r}</v></c>'
+    if isinstance(value, date):
+        return f'<c s="2"><v>{serial(value)!r}</v></c>'
+    return text(value)
+
+
+def row(values):
+    """
+    Строка листа без номеров строк и ячеек: они необязательны, и фрагменты листа,
+    собранные разными процессами, можно склеивать в любом количестве.
+    """
+    return '<row>' + ''.join(map(cell, values)) + '</row>'
+
+
+def write_rows(rows, file) -> int:
+    """
+    Пишет строки листа в бинарный файл. Возвращает число строк.
+    """
+    count = 0
+    for values in rows:
+        file.write(row(values).encode())
+        count += 1
+    return count
+
+
+class SharedStrings:
+    """
+    Таблица общих строк книги, ограниченная limit строками: повторяющиеся значения
+    (бренды, категории, даты обновления) пишутся в лист индексом, остальные — inline.
+    """
+    def __init__(self, limit=SHARED_STRINGS, max_length=64):
+        self.limit = limit
+        self.max_length = max_length
+        self.strings = {}
+
+    def index(self, value):
+        index = self.strings.get(value)
+        if index is None and len(self.strings) < self.limit and len(value) <= self.max_length:
+            index = self.strings[value] = len(self.strings)
+        return index
+
+    def xml(self):
+        yield SST_HEAD.format(count=len(self.strings))
+        for value in self.strings:
+            yield f'<si><t xml:space="preserve">{value.translate(TEXT)}</t></si>'
+        yield '</sst>'
+
+
+class Columns:
+    """
+    Разметка колонок, посчитанная один раз по заголовку и первым строкам листа:
+    ширины для <cols> и какие колонки повторяются настолько, чтобы писать их через общие строки.
+    """
+    def __init__(self, header, sample, strings: SharedStrings):
+        self.strings = strings
+        self.widths = []
+        self.shared = []
+        for i, name in enumerate(header):
+            values = [values[i] for values in sample if i < len(values)]
+            texts = [value for value in values if type(value) is str]
+            self.widths.append(min(max([len(str(name))] + [len(str(value)) for value in values if value is not None]) + 2, 60))
+            self.shared.append(bool(texts) and len(set(texts)) <= len(texts) / 2)
+
+    def cols(self):
+        return '<cols>' + ''.join(
+            f'<col min="{i}" max="{i}" width="{width}" customWidth="1"/>' for i, width in enumerate(self.widths, 1)
+        ) + '</cols>'
+
+    def row(self, values):
+        index = self.strings.index
+        cells = []
+        for value, shared in zip(values, self.shared):
+            if shared and type(value) is str:
+                position = index(value)
+                if position is not None:
+                    cells.append(f'<c t="s"><v>{position}</v></c>')
+                    continue
+            cells.append(cell(value))
+        cells.extend(map(cell, values[len(self.shared):]))
+        return '<row>' + ''.join(cells) + '</row>'
+
+
+class Sheet:
+    """
+    Лист книги: название и содержимое — строки rows (итератор, первая — заголовок)
+    или готовые фрагменты sheetData из файлов с заголовком header (None, если он уже во фрагментах).
+    """
+    def __init__(self, title, header=None, fragments=(), rows=None):
+        self.title = title
+        self.header = header
+        self.fragments = fragments
+        self.rows = rows
+
+
+class Chunks:
+    """
+    Приёмник zip-архива без seek: zipfile пишет в него, а генератор книги забирает накопленное.
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def sheet_rows(sheet: Sheet, strings: SharedStrings, sample=SAMPLE, batch=500):
+    """
+    XML листа из строк: разметка колонок считается по первым sample строкам,
+    строки пишутся пачками по batch, без объектов ячеек.
+    """
+    rows = iter(sheet.rows)
+    header = next(rows, None)
+    if header is None:
+        yield '<sheetData>'
+        return
+    head = list(islice(rows, sample))
+    columns = Columns(header, head, strings)
+    yield columns.cols() + '<sheetData>'
+    yield '<row>' + ''.join(f'<c s="1" t="inlineStr"><is><t>{str(name).translate(TEXT)}</t></is></c>' for name in header) + '</row>'
+    rows = chain(head, rows)
+    while True:
+        chunk = [columns.row(values) for values in islice(rows, batch)]
+        if not chunk:
+            return
+        yield ''.join(chunk)
+
+
+def book(sheets, shared_strings=SHARED_STRINGS, chunk_size=1024 * 1024):
+    """
+    Генератор байтов книги: XML листов пишется прямо в zip и отдаётся по мере записи,
+    книга целиком в памяти не собирается.
+
+    :param sheets: листы Sheet
+    :param shared_strings: предел таблицы общих строк
+    """
+    numbered = list(enumerate(sheets, 1))
+    strings = SharedStrings(shared_strings)
+    out = Chunks()
+    with zipfile.ZipFile(out, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+        archive.writestr('[Content_Types].xml', CONTENT_TYPES.format(
+            sheets=''.join(SHEET_TYPE.format(n=n) for n, _ in numbered)))
+        archive.writestr('_rels/.rels', ROOT_RELS)
+        archive.writestr('xl/workbook.xml', WORKBOOK.format(sheets=''.join(
+            SHEET_ENTRY.format(n=n, title=escape(sheet.title[:31], {'"': '&quot;'})) for n, sheet in numbered)))
+        archive.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS.format(
+            sheets=''.join(SHEET_REL.format(n=n) for n, _ in numbered)))
+        archive.writestr('xl/styles.xml', STYLES)
+        yield out.take()
+        for n, sheet in numbered:
+            with archive.open(f'xl/worksheets/sheet{n}.xml', 'w', force_zip64=True) as part:
+                part.write(SHEET_HEAD.encode())
+                if sheet.rows is not None:
+                    for data in sheet_rows(sheet, strings):
+                        part.write(data.encode())
+                        yield out.take()
+                else:
+                    part.write(b'<sheetData>')
+                    if sheet.header is not None:
+                        part.write(row(sheet.header).encode())
+                    for fragment in sheet.fragments:
+                        with open(fragment, 'rb') as file:
+                            while True:
+                                data = file.read(chunk_size)
+                                if not data:
+                                    break
+                                part.write(data)
+                                yield out.take()
+                part.write(SHEET_TAIL.encode())
+        with archive.open('xl/sharedStrings.xml', 'w') as part:
+            for data in strings.xml():
+                part.write(data.encode())
+    yield out.take()
+
+
+def write(rows, target, title='Products') -> int:
+    """
+    Пишет строки (первая — заголовок) книгой с одним листом.
+    Возвращает число строк товаров; пустую выгрузку не пишет.
+
+    :param rows: итератор строк
+    :param target: бинарный поток
+    """
+    rows = iter(rows)
+    header = next(rows, None)
+    if header is None:
+        return 0
+    count = 0
+
+    def counted():
+        nonlocal count
+        yield header
+        for values in rows:
+            count += 1
+            yield values
+
+    for data in book([Sheet(title, rows=counted())]):
+        target.write(data)
+    return count
+
+
+def assemble(path, header, fragments, title='Products'):
+    """
+    Собирает книгу с одним листом из заголовка и готовых фрагментов sheetData.
+
+    :param path: файл книги
+    :param header: названия колонок
+    :param fragments: файлы фрагментов в порядке строк
+    """
+    with open(path, 'wb') as file:
+        for data in book([Sheet(title, header, fragments)]):
+            file.write(data)
+
+
+def benchmark(count=100000):
+    """
+    Сравнение с openpyxl write-only на плоских строках товаров: секунды и размер файла.
+    """
+    import io
+    import openpyxl
+
+    brands = ['Acer', 'HP', 'LG', 'Samsung', 'Lenovo', 'ASUS']
+    updated = str(datetime.now())
+    header = ['productId', 'name', 'price', 'brandName', 'productUrl', 'inStock', 'Дата обновление']
+
+    def rows():
+        yield header
+        for i in range(count):
+            yield [f'p{i}', f'Ноутбук {i} 15.6" 16/512', 1000 + i * 0.5, brands[i % len(brands)], f'https://example.com/p/{i}', i % 3 > 0, updated]
+
+    def with_openpyxl(target):
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet('Products')
+        for values in rows():
+            ws.append(values)
+        wb.save(target)
+
+    results = {}
+    for name, writer in (('openpyxl', with_openpyxl), ('xlsx', lambda target: write(rows(), target))):
+        target = io.BytesIO()
+        started = time.perf_counter()
+        writer(target)
+        results[name] = (time.perf_counter() - started, len(target.getvalue()))
+    return results
+
+
+if __name__ == "__main__":
+    for name, (seconds, size) in benchmark().items():
+        print(f'{name:10} {seconds:6.2f} s {size / 1024 / 1024:6.2f} MB')